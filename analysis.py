@@ -3,23 +3,92 @@ import numpy as np
 import pandas as pd
 import os
 import json
+import re
 import sys
+import analysis_cache
+import event_store
+import log_parser
+from event_store import EVENTS_FILE, load_events
+from analysis_cache import AnalysisCache, content_key, outputs_current, record_outputs
+
+# Machine CSV files in a run folder: machine_<id>.csv
+MACHINE_CSV_PATTERN = re.compile(r"^machine_(\d+)\.csv$")
+
+# Skip the per-machine legend beyond this many machines
+MAX_LEGEND_ENTRIES = 10
+
+# Cached frames, metrics and plots are recomputed whenever the code of these modules changes;
+# bump ANALYSIS_VERSION to recompute them for any other reason (e.g. a pandas upgrade)
+CODE_FILES = [__file__, log_parser.__file__, event_store.__file__, analysis_cache.__file__]
+ANALYSIS_VERSION = 2
+
+# Cache of preprocessed frames and metrics, under the logs folder
+CACHE_DIR = ".analysis_cache"
+
+def machine_colors(n):
+    """One plot color per machine: the original three for small runs, a colormap beyond that."""
+    if n <= 3:
+        return ['blue', 'red', 'green'][:n]
+    return [plt.cm.viridis(x) for x in np.linspace(0, 1, n)]
+
+def find_machine_csvs(experiment_path):
+    """Return the machine CSV file names in a run folder, ordered by machine id."""
+    matches = [m for m in map(MACHINE_CSV_PATTERN.match, os.listdir(experiment_path)) if m]
+    return [m.group(0) for m in sorted(matches, key=lambda m: int(m.group(1)))]
 
 def preprocess(df):
     """Convert timestamp to datetime and round logical clock values."""
     # 1) Convert timestamp from object to datetime
-    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+    df["timestamp"] = pd.to_datetime(df["timestamp"], format="ISO8601", errors="coerce")
     # drop any invalid timestamps
     df = df.dropna(subset=["timestamp"])
     # round or clean up if desired
     df["logical_clock"] = df["logical_clock"].round(4)
+    # Monotonic timestamps give the true event order, even within one second
+    if "mono_ns" in df.columns and df["mono_ns"].notna().all():
+        df = df.sort_values("mono_ns", kind="stable").reset_index(drop=True)
     return df
 
+def compute_metrics(dataframes, experiment_config):
+    """Per-machine clock jump, queue length and inter-event interval stats, and the drift (spread) of logical clocks across machines."""
+    machines = []
+    clocks = []
+    for i, df in enumerate(dataframes):
+        df = df.sort_values("timestamp", kind="stable")
+        jumps = df["logical_clock"].diff().abs().dropna()
+        # Time between consecutive events (true latency with nanosecond timestamps)
+        intervals = df["timestamp"].diff().dropna().dt.total_seconds() * 1e3
+        machines.append({
+            "machine": i,
+            "clock_rate": experiment_config[f"machine_{i}"],
+            "events": len(df),
+            "final_clock": int(df["logical_clock"].iloc[-1]) if len(df) else 0,
+            "mean_jump": float(jumps.mean()) if len(jumps) else 0.0,
+            "max_jump": int(jumps.max()) if len(jumps) else 0,
+            "mean_queue_length": float(df["queue_length"].mean()) if len(df) else 0.0,
+            "max_queue_length": int(df["queue_length"].max()) if len(df) else 0,
+            "mean_interval_ms": float(intervals.mean()) if len(intervals) else 0.0,
+            "max_interval_ms": float(intervals.max()) if len(intervals) else 0.0,
+            "interval_jitter_ms": float(intervals.std(ddof=0)) if len(intervals) else 0.0,
+        })
+        # Each machine's clock at the end of every second it logged
+        clocks.append(df.groupby(df["timestamp"].dt.floor("s"))["logical_clock"].max().rename(i))
+
+    # Carry clocks forward over seconds a machine did not log; every clock starts at 0
+    clocks = pd.concat(clocks, axis=1).sort_index().ffill().fillna(0)
+    spread = clocks.max(axis=1) - clocks.min(axis=1)
+    return {
+        "machines": machines,
+        "final_drift": float(spread.iloc[-1]) if len(spread) else 0.0,
+        "mean_drift": float(spread.mean()) if len(spread) else 0.0,
+        "max_drift": float(spread.max()) if len(spread) else 0.0,
+    }
+
 def plot_raw(dataframes, experiment_path, experiment_config):
     """Plot the raw logical clock values for each machine."""
     plt.figure(figsize=(12, 6))
 
-    colors = ['blue', 'red', 'green']
+    colors = machine_colors(len(dataframes))
 
     for i, df in enumerate(dataframes):
         # Get machine clock rate
@@ -42,7 +111,8 @@ def plot_raw(dataframes, experiment_path, experiment_config):
     plt.xlabel("Timestamp")
     plt.ylabel("Logical Clock Value")
     plt.xticks(rotation=90)
-    plt.legend()
+    if len(dataframes) <= MAX_LEGEND_ENTRIES:
+        plt.legend()
     plt.grid(True)
     plt.tight_layout()
 
@@ -55,7 +125,7 @@ def plot_jumps(dataframes, experiment_path, experiment_config):
 
     plt.figure(figsize=(12, 6))
 
-    colors = ['blue', 'red', 'green']
+    colors = machine_colors(len(dataframes))
 
     for i, df in enumerate(dataframes):
         # Get machine clock rate
@@ -93,17 +163,18 @@ def plot_queue_length(dataframes, experiment_path, experiment_config):
     """Plot the queue length for each machine."""
     plt.figure(figsize=(10,6))
 
+    colors = machine_colors(len(dataframes))
     for i, df in enumerate(dataframes):
         # Get machine clock rate
         cr = experiment_config[f'machine_{i}']
 
-        colors = ['blue', 'red', 'green']
         plt.plot(df['timestamp'], df['queue_length'], label=f'Machine {i}: Clock Rate {cr}', color=colors[i])
 
     plt.xlabel('Timestamp')
     plt.ylabel('Queue Length')
     plt.title('Queue Length for Each Machine')
-    plt.legend()
+    if len(dataframes) <= MAX_LEGEND_ENTRIES:
+        plt.legend()
     plt.grid(True)
     plt.xticks(rotation=90)
     plt.tight_layout()
@@ -115,11 +186,11 @@ def plot_operations(dataframes, experiment_path, experiment_config):
 
     plt.figure(figsize=(10,6))
 
+    colors = machine_colors(len(dataframes))
     for i, df in enumerate(dataframes):
         #Createa a new dataframe 
         cr = experiment_config[f'machine_{i}']
 
-        colors = ['blue', 'red', 'green']
 
         operation_counts = df['operation'].value_counts().sort_index()
 
@@ -131,7 +202,8 @@ def plot_operations(dataframes, experiment_path, experiment_config):
     plt.xlabel('Operation')
     plt.ylabel('Count')
     plt.title('Operation Count per Machine')
-    plt.legend()
+    if len(dataframes) <= MAX_LEGEND_ENTRIES:
+        plt.legend()
     plt.grid(True)
     plt.tight_layout()
     plt.savefig(os.path.join(experiment_path, "plot_op_count.png"))
@@ -147,43 +219,69 @@ if __name__ == "__main__":
         log_folders = [sys.argv[1]]
     else:
         log_folders = os.listdir(logs_directory)
+
+    # Preprocessed frames and metrics are cached by the content of each run's inputs and of
+    # the code that parses and analyses them; plots are only redrawn if either changed
+    cache = AnalysisCache(os.path.join(logs_directory, CACHE_DIR))
+    code_version = content_key(CODE_FILES, ANALYSIS_VERSION)
  
     for experiment in log_folders:
         # input("EXPERIMENT")
         experiment_path = os.path.join(logs_directory, experiment)
         
         # Skip if not a directory
-        if not os.path.isdir(experiment_path):
+        if not os.path.isdir(experiment_path) or experiment == CACHE_DIR:
             continue  
 
-        # Find the experiment configs
-        experiment_config_path = os.path.join(experiment_path, "clock_rates.json")
-        if not os.path.exists(experiment_config_path):
-            print(f"Skipping {experiment} (Missing experiment config)")
+        # Compacted runs (event_store.py) load straight into typed columns, no parsing needed
+        compacted = os.path.exists(os.path.join(experiment_path, EVENTS_FILE))
+        if compacted:
+            inputs = [EVENTS_FILE]
+        else:
+            # Find the experiment configs
+            experiment_config_path = os.path.join(experiment_path, "clock_rates.json")
+            if not os.path.exists(experiment_config_path):
+                print(f"Skipping {experiment} (Missing experiment config)")
+                continue
+            with open(experiment_config_path, "r") as f:
+                experiment_config = json.load(f)
+
+            # Find the machine CSV files in the experiment directory, ordered by machine number
+            csv_files = find_machine_csvs(experiment_path)
+
+            if not csv_files or len(csv_files) != len(experiment_config):
+                print(f"Skipping {experiment} (Expected {len(experiment_config)} CSV files, found {len(csv_files)})")
+                continue
+            inputs = ["clock_rates.json"] + csv_files
+
+        data_key = content_key([os.path.join(experiment_path, f) for f in inputs], code_version)
+        if outputs_current(experiment_path, data_key):
+            print(f"Skipping {experiment} (Unchanged since last analysis)")
             continue
-        with open(experiment_config_path, "r") as f:
-            experiment_config = json.load(f)
 
-        # Find the CSV files in the experiment directory
-        csv_files = [f for f in os.listdir(experiment_path) if f.endswith(".csv")]
-        # Order by machine number
-        csv_files = sorted(csv_files, key=lambda x: x[-5])
-        
-        if len(csv_files) != 3:
-            print(f"Skipping {experiment} (Expected 3 CSV files, found {len(csv_files)})")
-            continue
-
-        # Read each CSV file (modify column names as needed)
-        dataframes = [pd.read_csv(os.path.join(experiment_path, csv)) for csv in csv_files]
-        print(csv_files)
-
-        # Preprocess the dataframes
-        dataframes = [preprocess(df) for df in dataframes]
+        cached = cache.get(data_key)
+        if cached is not None:
+            experiment_config, dataframes, metrics = cached
+        else:
+            if compacted:
+                experiment_config, dataframes = load_events(experiment_path)
+            else:
+                # Read each CSV file (modify column names as needed)
+                dataframes = [pd.read_csv(os.path.join(experiment_path, csv)) for csv in csv_files]
+                print(csv_files)
+
+            # Preprocess the dataframes, whichever store they came from
+            dataframes = [preprocess(df) for df in dataframes]
+            metrics = compute_metrics(dataframes, experiment_config)
+            cache.put(data_key, (experiment_config, dataframes, metrics))
+
+        with open(os.path.join(experiment_path, "metrics.json"), "w") as f:
+            json.dump(metrics, f, indent=2)
 
         # plot_raw(dataframes, experiment_path, experiment_config)
         # plot_queue_length(dataframes, experiment_path, experiment_config)
         # plot_operations(dataframes, experiment_path, experiment_config)
         plot_jumps(dataframes, experiment_path, experiment_config)
+        record_outputs(experiment_path, data_key, ["metrics.json"] + [f"plot_jumps_{i}.png" for i in range(len(dataframes))])
 
-
-
+    print(f"Analysis cache: {cache.hits} hits, {cache.misses} misses, {cache.size() / 2**20:.1f} MB")
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import pickle
+
+# Default cache size; least recently used entries are evicted beyond it
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+# Per-run record of the key its plots were made from
+OUTPUTS_FILE = ".analysis_outputs.json"
+
+def file_digest(path, block_size=2**20):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+def content_key(paths, version):
+    """Cache key for a set of input files (by content, not name or mtime) and a code version."""
+    digest = hashlib.sha256(str(version).encode())
+    for path in paths:
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+class AnalysisCache:
+    """On-disk cache of analysis results (e.g. preprocessed frames and metrics), one pickle per key.
+
+    Reading an entry marks it as recently used; when the cache grows beyond max_bytes
+    the least recently used entries are removed.
+    """
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store value under key, then evict old entries if the cache is over its size limit."""
+        path = self._path(key)
+        # Write then rename, so readers never see a partial entry
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".pkl"):
+                st = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((st.st_mtime_ns, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+    def size(self):
+        """Bytes used by cache entries."""
+        return sum(os.path.getsize(os.path.join(self.cache_dir, n)) for n in os.listdir(self.cache_dir) if n.endswith(".pkl"))
+
+def outputs_current(run_path, key):
+    """True if a run's recorded outputs were made from key and all still exist."""
+    path = os.path.join(run_path, OUTPUTS_FILE)
+    if not os.path.exists(path):
+        return False
+    with open(path, "r") as f:
+        record = json.load(f)
+    return record.get("key") == key and all(os.path.exists(os.path.join(run_path, o)) for o in record["outputs"])
+
+def record_outputs(run_path, key, outputs):
+    """Remember that a run's outputs were made from key."""
+    with open(os.path.join(run_path, OUTPUTS_FILE), "w") as f:
+        json.dump({"key": key, "outputs": outputs}, f)
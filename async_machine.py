@@ -0,0 +1,232 @@
+import asyncio
+import json
+import random
+import time
+from collections import deque
+from machine import DEFAULT_PROCESS_BATCH, apply_received, process_limit, setup_logger
+from topology import ActionModel
+from latency import LatencyStats
+from scheduler import START_LEAD_NS, TickScheduler
+from metrics import MetricsServer, render_metrics
+from transport import peer_address
+from wire import Message, FrameDecoder
+
+class AsyncMachine:
+    """Machine runtime built on asyncio: stream server, peer clients and ticks share one event loop."""
+    def __init__(self, machine_id: int, host: str, port: int, clock_rate: int, peers: list, peers_id: list, log_path=None, retry_interval=0.5, peer_weights=None, log_format="text", tick_policy="skip", process_policy="one", process_batch=DEFAULT_PROCESS_BATCH, metrics_port=None, seed=None):
+        """Initialize the machine."""
+
+        # Initialize the logical clock
+        self.logical_clock = 0
+        self.clock_rate = clock_rate
+        self.cycle_time = 1 / clock_rate
+
+        # Initialize the peers and message queue
+        self.machine_id = machine_id
+        self.peers = peers # list of peer addresses: [50051, 50052] on our host, or "host:port" on others
+        self.peers_id = peers_id # list of peer ids: [0, 1]
+        self.peer_weights = peer_weights
+        self.host = host
+        self.port = port
+        self.peer_addresses = [peer_address(peer, host) for peer in peers]
+        # Only the event loop touches the inbox, so a plain deque needs no locking
+        self.message_queue = deque()
+
+        # Outbound streams and the frames waiting to be flushed at the end of the tick
+        self.writers = [None] * len(peers)
+        self.pending = [[] for _ in peers]
+        self.retry_interval = retry_interval
+        self._next_attempt = [0.0] * len(peers)
+
+        # Next sequence number on each outbound link, and latency / loss of received messages
+        self.next_seq = [0] * len(peers)
+        self.latency = LatencyStats()
+
+        self.running = False
+        self.log_path = log_path
+        self.log_format = log_format
+        self.server = None
+        self.readers = set()
+        self.ticks = 0
+        self.scheduler = TickScheduler(clock_rate, tick_policy)
+        self.process_policy = process_policy
+        self.process_limit = process_limit(process_policy, process_batch)
+
+        # Actions are drawn from our own stream, so a run is reproducible from its seeds
+        self.rng = random.Random(seed)
+
+        # Live counters served on metrics_port (if set) while the machine runs
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.internal_events = 0
+        self.send_errors = 0
+
+    async def start(self):
+        """Start listening for peer streams and open the log"""
+        self.server = await asyncio.start_server(self._service_stream, self.host, self.port)
+        self.running = True
+        if self.metrics_port is not None:
+            self.metrics_server = MetricsServer(self.host, self.metrics_port, self.metrics_text)
+
+        # Initialize the logger
+        self.logger = setup_logger(self.log_path, self.machine_id, self.log_format)
+        # Write first log message
+        self.logger.info(f"[INIT] with clock rate {self.clock_rate} and peers {self.peers}, {self.peers_id}")
+
+    async def _service_stream(self, reader, writer):
+        """Read framed messages from a peer stream until it closes"""
+        decoder = FrameDecoder()
+        task = asyncio.current_task()
+        self.readers.add(task)
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                messages = decoder.messages(data)
+                enqueue_ns = time.monotonic_ns()
+                for message in messages:
+                    message.enqueue_ns = enqueue_ns
+                self.message_queue.extend(messages)
+        except Exception as e:
+            self.logger.error(f"Error servicing connection from peer: {e}")
+        finally:
+            writer.close()
+            self.readers.discard(task)
+
+    async def _get_writer(self, target):
+        """Return the stream to a peer, reconnecting if it is missing or broken"""
+        writer = self.writers[target]
+        if writer is not None and not writer.is_closing():
+            return writer
+
+        # Back off instead of hammering a peer that refused us moments ago
+        loop = asyncio.get_running_loop()
+        if loop.time() < self._next_attempt[target]:
+            raise ConnectionError("peer {}:{} unavailable, retrying later".format(*self.peer_addresses[target]))
+        try:
+            _, writer = await asyncio.open_connection(*self.peer_addresses[target])
+        except OSError:
+            self._next_attempt[target] = loop.time() + self.retry_interval
+            raise
+        self.writers[target] = writer
+        return writer
+
+    def _send_message(self, target):
+        """Queue a message to peer for the end-of-tick flush"""
+        msg = Message(self.machine_id, self.logical_clock, time.monotonic_ns(), self.next_seq[target])
+        self.next_seq[target] += 1
+        self.pending[target].append(msg.to_bytes())
+        self.logger.event("SENT", self.logical_clock, peer=self.peers_id[target])
+
+    async def _flush_sends(self):
+        """Write each peer's queued messages in a single write"""
+        for target, frames in enumerate(self.pending):
+            if not frames:
+                continue
+            self.pending[target] = []
+            try:
+                writer = await self._get_writer(target)
+                writer.write(b"".join(frames))
+                # Respect the transport's flow control if the peer is slow to read
+                await writer.drain()
+            except Exception as e:
+                self.writers[target] = None
+                self.send_errors += 1
+                self.logger.error(f"Error sending message to port {target}: {e}")
+
+    def _tick(self, actions):
+        """Process one clock tick: handle queued messages (per the processing policy) or take a random action"""
+        if self.message_queue:
+            queue = self.message_queue
+            n = len(queue) if self.process_limit is None else min(self.process_limit, len(queue))
+            messages = [queue.popleft() for _ in range(n)]
+            apply_received(self, messages, len(queue), self.process_policy == "drain")
+        else:
+            targets = actions.choose(self.rng)
+            if targets:
+                for i in targets:
+                    self._send_message(i)
+                self.logical_clock += 1
+            # Trigger an internal event
+            else:
+                self.logical_clock += 1
+                self.internal_events += 1
+                self.logger.event("INTERNAL", self.logical_clock)
+
+    async def run(self, p_a, p_b, p_c, start_ns=None):
+        """Main loop, paced by absolute deadlines on the monotonic clock (from start_ns if given)"""
+        actions = ActionModel.from_thresholds(p_a, p_b, p_c, len(self.peers), self.peer_weights)
+        if start_ns is not None:
+            await asyncio.sleep(max(0, start_ns - time.monotonic_ns()) / 1e9)
+        self.scheduler.start(start_ns)
+        while self.running:
+            self._tick(actions)
+            self.ticks += 1
+            await self._flush_sends()
+
+            # Sleep until the next tick's deadline (skip or catch up if we fell behind)
+            await asyncio.sleep(self.scheduler.sleep_time())
+            self.scheduler.tick_started()
+
+    def stop(self):
+        """Signal the run loop to end after the current tick"""
+        self.running = False
+
+    def metrics(self):
+        """Current values of the live metrics (see metrics.METRICS)"""
+        return {"logical_clock": self.logical_clock, "queue_length": len(self.message_queue), "clock_rate": self.clock_rate,
+                "ticks_total": self.scheduler.ticks, "tick_overruns_total": self.scheduler.overruns,
+                "messages_sent_total": sum(self.next_seq), "messages_received_total": sum(self.latency.received.values()),
+                "internal_events_total": self.internal_events, "send_errors_total": self.send_errors}
+
+    def metrics_text(self):
+        return render_metrics(self.machine_id, self.metrics())
+
+    def stats(self):
+        """Collect run statistics for this machine"""
+        return {"machine_id": self.machine_id, "logging": self.logger.summary(), "latency": self.latency.summary(),
+                "scheduling": self.scheduler.summary(),
+                "sent": {str(self.peers_id[i]): n for i, n in enumerate(self.next_seq)}}
+
+    async def close(self):
+        """Close peer streams and the server, and save run statistics"""
+        for writer in self.writers:
+            if writer is not None:
+                writer.close()
+        if self.server is not None:
+            self.server.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        self.logger.close()
+        if self.log_path is not None:
+            with open(f"{self.log_path}/machine_{self.machine_id}_stats.json", "w") as f:
+                json.dump(self.stats(), f, indent=2)
+
+async def run_cluster(machines: list, p_a, p_b, p_c, duration, abort=None):
+    """Run a list of AsyncMachines on the current event loop for duration seconds
+
+    abort: optional threading.Event that ends the run early when set (e.g. by a metrics aggregator)
+    Returns the startup time in seconds, until the common first tick of every machine.
+    """
+    launch_ns = time.monotonic_ns()
+    await asyncio.gather(*(m.start() for m in machines))
+    start_ns = time.monotonic_ns() + START_LEAD_NS
+    tasks = [asyncio.create_task(m.run(p_a, p_b, p_c, start_ns)) for m in machines]
+    if abort is None:
+        await asyncio.sleep(duration)
+    else:
+        await asyncio.to_thread(abort.wait, duration)
+
+    # Stop all machines
+    for m in machines:
+        m.stop()
+    await asyncio.gather(*tasks)
+    for m in machines:
+        await m.close()
+
+    # Closing every outbound stream lets the peers' readers see EOF and finish
+    readers = [t for m in machines for t in m.readers]
+    if readers:
+        await asyncio.wait(readers, timeout=1)
+    return (start_ns - launch_ns) / 1e9
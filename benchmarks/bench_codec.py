@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import system_pb2
+from wire import Message, FrameDecoder, encode_frame
+
+N = 200_000
+
+def bench(label, fn):
+    """Time fn over N iterations and print the rate."""
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {N / elapsed:>12,.0f} msg/s  ({elapsed * 1e9 / N:,.0f} ns/msg)")
+
+def json_roundtrip():
+    for i in range(N):
+        data = Message(1, i).to_json().encode()
+        Message.from_json(data.decode())
+
+def binary_roundtrip():
+    decoder = FrameDecoder()
+    for i in range(N):
+        decoder.messages(Message(1, i).to_bytes())
+
+def binary_stream():
+    # Many frames delivered in a single read, as on a busy pooled stream
+    data = b"".join(Message(1, i).to_bytes() for i in range(N))
+    FrameDecoder().messages(data)
+
+def proto_roundtrip():
+    decoder = FrameDecoder()
+    for i in range(N):
+        payload = system_pb2.Message(sender_id=1, logical_clock=i).SerializeToString()
+        for _, body in decoder.feed(encode_frame(payload)):
+            system_pb2.Message.FromString(body)
+
+if __name__ == "__main__":
+    print(f"Encode + decode of {N:,} messages")
+    bench("json (current)", json_roundtrip)
+    bench("struct frame", binary_roundtrip)
+    bench("struct frame, one read", binary_stream)
+    bench("protobuf frame", proto_roundtrip)
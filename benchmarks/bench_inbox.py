@@ -0,0 +1,52 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from inbox import Inbox
+
+N = 20_000
+
+def tick_loop(q, n):
+    """Mimic the old run loop: empty / get / qsize per message."""
+    for i in range(n):
+        q.put(i)
+    for _ in range(n):
+        if not q.empty():
+            q.get()
+            q.qsize()
+
+def threaded(q, n, drain):
+    """A listener thread produces while the run loop consumes."""
+    def produce():
+        for i in range(n):
+            q.put(i)
+    producer = threading.Thread(target=produce)
+    producer.start()
+    received = 0
+    while received < n:
+        if drain:
+            received += len(q.drain())
+        else:
+            item = q.get(timeout=1)
+            if item is not None:
+                received += 1
+    producer.join()
+
+def bench(label, fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {N / elapsed:>12,.0f} msg/s  ({elapsed * 1e6 / N:,.1f} us/msg)")
+
+if __name__ == "__main__":
+    manager = multiprocessing.Manager()
+    print(f"{N:,} messages per scenario")
+    bench("Manager queue, tick loop", tick_loop, manager.Queue(), N)
+    bench("Inbox, tick loop", tick_loop, Inbox(), N)
+    bench("Manager queue, producer thread", threaded, manager.Queue(), N, False)
+    bench("Inbox, producer thread", threaded, Inbox(), N, False)
+    bench("Inbox, producer thread + drain", threaded, Inbox(), N, True)
+    manager.shutdown()
@@ -0,0 +1,49 @@
+import os
+import re
+import sys
+import tempfile
+import time
+import pandas as pd
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from log_parser import COLUMNS, EVENT_OPS, TIMESTAMP_PATTERN, get_clock_rate, load_log_file, stream_log_to_csv
+from simulation import Simulation
+
+DURATION = 20_000 # virtual seconds of a 3-machine run at 6 ticks/s
+
+def per_field_parse(log_file, csv_file):
+    """The previous parser: read the whole file, then one regex search per field per line."""
+    lines = load_log_file(log_file)
+    get_clock_rate(lines.pop(0))
+    row_list = []
+    for l in lines:
+        timestamp = TIMESTAMP_PATTERN.search(l).group(0)
+        op_match = re.search(r"\[(\w+)\]", l)
+        if op_match is None or op_match.group(1) not in EVENT_OPS:
+            continue
+        operation = op_match.group(1)
+        logical_clock = int(re.search(r"Logical clock: (\d+)", l).group(1))
+        queue_length = 0
+        if operation == "RECEIVED":
+            queue_length = int(re.search(r"Queue length: (\d+)", l).group(1))
+        row_list.append([timestamp, operation, logical_clock, queue_length])
+    pd.DataFrame(row_list, columns=COLUMNS).to_csv(csv_file, index=False)
+    return len(lines) + 1
+
+def streaming_parse(log_file, csv_file):
+    return stream_log_to_csv(log_file, csv_file)[1]
+
+def bench(label, fn, log_file, csv_file):
+    start = time.perf_counter()
+    n_lines = fn(log_file, csv_file)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {n_lines / elapsed:>12,.0f} lines/s  ({elapsed:.2f}s)")
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as temp_dir:
+        Simulation([6, 6, 6], 2, 3, 4, seed=0, log_path=temp_dir).run(DURATION)
+        log_file = os.path.join(temp_dir, "machine_0.log")
+        csv_file = os.path.join(temp_dir, "machine_0.csv")
+        print(f"{os.path.getsize(log_file) / 1e6:,.1f} MB log")
+        bench("per-field regexes", per_field_parse, log_file, csv_file)
+        bench("streaming single regex", streaming_parse, log_file, csv_file)
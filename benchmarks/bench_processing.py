@@ -0,0 +1,46 @@
+import asyncio
+import os
+import sys
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from async_machine import AsyncMachine, run_cluster
+from log_parser import load_log_file, parse_machine_log
+
+BASE_PORT = 56100
+# One slow machine that the two fast ones flood with messages
+CLOCK_RATES = [1, 6, 6]
+BATCH = 4
+DURATION = 10
+
+def build(log_path, policy):
+    """Create a full mesh of AsyncMachines handling their inboxes under policy."""
+    machines = []
+    n = len(CLOCK_RATES)
+    for i, rate in enumerate(CLOCK_RATES):
+        peers = [BASE_PORT + j for j in range(n) if j != i]
+        peers_id = [j for j in range(n) if j != i]
+        machines.append(AsyncMachine(i, "localhost", BASE_PORT + i, rate, peers, peers_id, log_path=log_path,
+                                     process_policy=policy, process_batch=BATCH))
+    return machines
+
+if __name__ == "__main__":
+    # Processing policies to compare, e.g. python benchmarks/bench_processing.py one drain
+    policies = sys.argv[1:] or ["one", "batch", "drain"]
+    for policy in policies:
+        with tempfile.TemporaryDirectory() as log_path:
+            machines = build(log_path, policy)
+            asyncio.run(run_cluster(machines, 2, 3, 4, DURATION))
+
+            # The slow machine's inbox and Lamport jumps, from its log
+            slow = machines[0]
+            df = parse_machine_log(load_log_file(os.path.join(log_path, "machine_0.log")))
+            received = df[df["operation"] == "RECEIVED"]
+            jumps = df["logical_clock"].diff().dropna()
+            e2e = slow.latency.histograms["end_to_end"].summary()
+            label = f"{policy}({BATCH})" if policy == "batch" else policy
+            print(f"{label:>9}: slow machine received {len(received) / DURATION:6.1f} msgs/s, "
+                  f"max queue {received['queue_length'].max() if len(received) else 0:>3}, "
+                  f"left queued {len(slow.message_queue):>3}, "
+                  f"end-to-end p50 {e2e['p50_ms']:7.1f} ms p99 {e2e['p99_ms']:7.1f} ms, "
+                  f"mean clock jump {jumps.mean():.2f}")
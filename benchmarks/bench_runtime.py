@@ -0,0 +1,35 @@
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from async_machine import AsyncMachine, run_cluster
+
+BASE_PORT = 56000
+CLOCK_RATE = 6
+DURATION = 5
+
+def build(n, log_path):
+    """Create a full mesh of n AsyncMachines."""
+    machines = []
+    for i in range(n):
+        peers = [BASE_PORT + j for j in range(n) if j != i]
+        peers_id = [j for j in range(n) if j != i]
+        machines.append(AsyncMachine(i, "localhost", BASE_PORT + i, CLOCK_RATE, peers, peers_id, log_path=log_path))
+    return machines
+
+if __name__ == "__main__":
+    # Machine counts to try, e.g. python benchmarks/bench_runtime.py 10 50 100
+    counts = [int(n) for n in sys.argv[1:]] or [3, 25, 100]
+    for n in counts:
+        with tempfile.TemporaryDirectory() as log_path:
+            machines = build(n, log_path)
+            start = time.process_time()
+            asyncio.run(run_cluster(machines, 2, 3, 4, DURATION))
+            cpu = time.process_time() - start
+            achieved = sum(m.ticks for m in machines) / (n * DURATION)
+            print(f"{n:>4} machines, 1 process, {threading.active_count()} thread(s): "
+                  f"{achieved:.2f}/{CLOCK_RATE} ticks/s per machine, {cpu / DURATION:.0%} of one core")
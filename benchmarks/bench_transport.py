@@ -0,0 +1,87 @@
+import os
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# gRPC logs the peer's shutdown of every stream at INFO level
+os.environ.setdefault("GRPC_VERBOSITY", "ERROR")
+
+from latency import LatencyHistogram
+from machine import Machine
+
+BASE_PORT = 56200
+MESSAGES = 19_200
+# Messages per flush when measuring throughput: 1 is a write per message, larger batches coalesce like busy ticks
+BATCH_SIZES = [1, 64]
+# Round trips for the latency measurement, one message in flight at a time
+PINGS = 2_000
+
+def pair(transport, port, log_path):
+    """A receiving and a sending Machine with their servers up and the stream between them warmed up."""
+    receiver = Machine(0, "localhost", port, 1, [port + 1], [1], log_path=log_path, transport=transport)
+    sender = Machine(1, "localhost", port + 1, 1, [port], [0], log_path=log_path, transport=transport)
+    receiver._start_server()
+    sender._start_server()
+    sender._send_message(0)
+    sender._flush_sends()
+    while not receiver.message_queue.drain():
+        time.sleep(0.001)
+    return receiver, sender
+
+def close(*machines):
+    for m in machines:
+        m.stop()
+        m.logger.close()
+
+def throughput(transport, batch_size, port):
+    """(messages/s, sender seconds per message) streaming MESSAGES from one Machine to another.
+
+    The sender's time is what its tick loop spends creating and flushing messages.
+    """
+    with tempfile.TemporaryDirectory() as log_path:
+        receiver, sender = pair(transport, port, log_path)
+        received = 0
+        sending = 0.0
+        start = time.perf_counter()
+        for i in range(0, MESSAGES, batch_size):
+            send_start = time.perf_counter()
+            for _ in range(batch_size):
+                sender._send_message(0)
+            sender._flush_sends()
+            sending += time.perf_counter() - send_start
+            # Drain as we go, as the run loop would
+            received += len(receiver.message_queue.drain())
+        while received < MESSAGES:
+            received += len(receiver.message_queue.drain())
+            time.sleep(0.0001)
+        elapsed = time.perf_counter() - start
+        close(sender, receiver)
+        return MESSAGES / elapsed, sending / MESSAGES
+
+def latency(transport, port):
+    """Histogram of send -> receiver inbox latency with a single message in flight."""
+    with tempfile.TemporaryDirectory() as log_path:
+        receiver, sender = pair(transport, port, log_path)
+        histogram = LatencyHistogram()
+        for _ in range(PINGS):
+            sender._send_message(0)
+            sender._flush_sends()
+            message = receiver.message_queue.get(timeout=1)
+            histogram.add(message.enqueue_ns - message.send_ns)
+        close(sender, receiver)
+        return histogram
+
+if __name__ == "__main__":
+    # Transports to compare, e.g. python benchmarks/bench_transport.py grpc
+    transports = sys.argv[1:] or ["socket", "grpc", "shm"]
+    port = BASE_PORT
+    for transport in transports:
+        rates = []
+        for batch_size in BATCH_SIZES:
+            rate, send_cost = throughput(transport, batch_size, port)
+            rates.append(f"{batch_size:>2} msgs/flush {rate:>9,.0f} msg/s ({send_cost * 1e6:5.1f} us/msg to send)")
+            port += 2
+        summary = latency(transport, port).summary()
+        port += 2
+        print(f"{transport:>6}: {', '.join(rates)}; "
+              f"latency p50 {summary['p50_ms']:.3f} ms p99 {summary['p99_ms']:.3f} ms")
@@ -0,0 +1,293 @@
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import yaml
+from event_log import write_run_anchor
+from machine import run_machine
+from scheduler import StartBarrier
+from transport import peer_address
+
+# How long the coordinator waits for nodes to connect, and for their machines to be listening
+NODE_TIMEOUT = 120.0
+
+# Time between the coordinator's start (or stop) message and the instant every node acts on
+# it, enough for the message to reach every node. Nodes agree on the instant by wall clock,
+# so their clocks should be in sync to well within this (e.g. by NTP).
+START_LEAD_NS = 200_000_000
+
+class ClusterSpec:
+    """Where every machine of a cluster listens, and where main.py coordinates the nodes running them.
+
+    A spec file is YAML, with addresses as "host:port":
+
+        coordinator: 10.0.0.1:50040
+        machines:
+          0: 10.0.0.1:50050
+          1: 10.0.0.1:50051
+          2: 10.0.0.2:50050
+    """
+    def __init__(self, machines: dict, coordinator=None):
+        self.machines = {int(i): peer_address(address, "localhost") for i, address in machines.items()}
+        self.coordinator = peer_address(coordinator, "localhost") if coordinator is not None else None
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            spec = yaml.safe_load(f)
+        if spec.get("coordinator") is None:
+            raise ValueError(f"{path} has no coordinator address for the nodes to connect to")
+        return cls(spec["machines"], spec["coordinator"])
+
+    @classmethod
+    def single_host(cls, n_machines, host, base_port):
+        """Every machine on one host, on consecutive ports (the layout without a spec)."""
+        return cls({i: (host, base_port + i) for i in range(n_machines)})
+
+    def save(self, path):
+        spec = {"machines": {i: f"{host}:{port}" for i, (host, port) in self.machines.items()}}
+        if self.coordinator is not None:
+            spec["coordinator"] = "{}:{}".format(*self.coordinator)
+        with open(path, "w") as f:
+            yaml.dump(spec, f)
+
+    def peer(self, machine_id, peer_id):
+        """How machine_id addresses peer_id: just the port on its own host, "host:port" otherwise."""
+        host, port = self.machines[peer_id]
+        return port if host == self.machines[machine_id][0] else f"{host}:{port}"
+
+    def select(self, selector=None):
+        """Machine ids a node runs: all of them, those on a host, or a comma-separated list of ids."""
+        if selector is None:
+            return sorted(self.machines)
+        if all(part.strip().isdigit() for part in selector.split(",")):
+            ids = [int(part) for part in selector.split(",")]
+            unknown = [i for i in ids if i not in self.machines]
+            if unknown:
+                raise ValueError(f"machines {unknown} are not in the cluster spec")
+            return ids
+        return sorted(i for i, (host, _) in self.machines.items() if host == selector)
+
+def send_json(f, message):
+    f.write(json.dumps(message).encode() + b"\n")
+    f.flush()
+
+def recv_json(f):
+    """Next control message on a stream, or None once it has closed."""
+    line = f.readline()
+    return json.loads(line) if line else None
+
+def send_files(f, folder):
+    """Stream every file in folder, each as a header message followed by its bytes."""
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        send_json(f, {"file": name, "size": os.path.getsize(path)})
+        with open(path, "rb") as src:
+            shutil.copyfileobj(src, f)
+    send_json(f, {"done": True})
+
+def receive_files(f, folder):
+    """Write files streamed by send_files into folder; returns how many there were."""
+    count = 0
+    while True:
+        header = recv_json(f)
+        if header is None:
+            raise ConnectionError("node closed its connection while sending logs")
+        if header.get("done"):
+            return count
+        with open(os.path.join(folder, os.path.basename(header["file"])), "wb") as out:
+            remaining = header["size"]
+            while remaining:
+                chunk = f.read(min(remaining, 1 << 20))
+                if not chunk:
+                    raise ConnectionError("node closed its connection while sending logs")
+                out.write(chunk)
+                remaining -= len(chunk)
+        count += 1
+
+def wall_to_monotonic(wall_ns):
+    """This host's monotonic instant (ns) for a wall-clock instant."""
+    return time.monotonic_ns() + wall_ns - time.time_ns()
+
+class Node:
+    """A launcher connected to the coordinator, and the machines it runs."""
+    def __init__(self, conn, name, machine_ids):
+        self.conn = conn
+        self.file = conn.makefile("rwb")
+        self.name = name
+        self.machine_ids = machine_ids
+
+class Coordinator:
+    """main.py's side of a multi-node cluster: node launchers connect to it and it runs each trial across them.
+
+    Per trial it sends every node the arguments of its machines, waits until all of them are
+    listening, then has every node start them at one wall-clock instant. When the trial is
+    over it stops them all at one instant and gathers each node's logs into the run folder.
+    """
+    def __init__(self, spec: ClusterSpec, timeout=NODE_TIMEOUT):
+        self.spec = spec
+        self.timeout = timeout
+        self.nodes = []
+        self.server = socket.create_server(spec.coordinator)
+
+    def wait_for_nodes(self):
+        """Accept launchers until each machine of the spec belongs to exactly one node."""
+        unclaimed = set(self.spec.machines)
+        deadline = time.monotonic() + self.timeout
+        while unclaimed:
+            self.server.settimeout(max(0.0, deadline - time.monotonic()))
+            try:
+                conn, address = self.server.accept()
+            except socket.timeout:
+                raise TimeoutError(f"no node launched machines {sorted(unclaimed)} within {self.timeout:.0f}s") from None
+            conn.settimeout(self.timeout)
+            node = Node(conn, None, [])
+            hello = recv_json(node.file)
+            if hello is None:
+                conn.close()
+                continue
+            node.name, node.machine_ids = hello["node"], hello["machines"]
+            taken = [i for i in node.machine_ids if i not in unclaimed]
+            if taken:
+                send_json(node.file, {"error": f"machines {taken} are unknown or already run by another node"})
+                conn.close()
+                continue
+            unclaimed -= set(node.machine_ids)
+            self.nodes.append(node)
+            print(f"[CLUSTER] node {node.name} ({address[0]}) runs machines {node.machine_ids}")
+
+    def start_trial(self, run_name, machines: list, probabilities):
+        """Launch every machine on its node, and return at their common first tick (wall-clock ns).
+
+        machines: Machine keyword arguments, indexed by machine id. Raises
+        threading.BrokenBarrierError if any machine failed to start; stop_trial() still
+        has to be called to collect the logs.
+        """
+        for node in self.nodes:
+            send_json(node.file, {"run": run_name, "probabilities": list(probabilities),
+                                  "machines": {str(i): machines[i] for i in node.machine_ids}})
+        errors = []
+        for node in self.nodes:
+            reply = recv_json(node.file)
+            if reply is None:
+                raise ConnectionError(f"node {node.name} went away")
+            if "error" in reply:
+                errors.append(reply["error"])
+        if errors:
+            for node in self.nodes:
+                send_json(node.file, {"abort": True})
+            raise threading.BrokenBarrierError("; ".join(errors))
+
+        start_ns = time.time_ns() + START_LEAD_NS
+        for node in self.nodes:
+            send_json(node.file, {"start_ns": start_ns})
+        time.sleep(max(0, start_ns - time.time_ns()) / 1e9)
+        return start_ns
+
+    def stop_trial(self, log_folder):
+        """Stop every node's machines at one instant and gather their logs into log_folder."""
+        stop_ns = time.time_ns() + START_LEAD_NS
+        for node in self.nodes:
+            send_json(node.file, {"stop_ns": stop_ns})
+        for node in self.nodes:
+            count = receive_files(node.file, log_folder)
+            print(f"[CLUSTER] gathered {count} files from node {node.name}")
+
+    def close(self):
+        # Launchers exit when their connection closes
+        for node in self.nodes:
+            node.file.close()
+            node.conn.close()
+        self.server.close()
+
+def connect(address, timeout=NODE_TIMEOUT):
+    """Connect to the coordinator, waiting for it to come up."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn = socket.create_connection(address, timeout=1.0)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+            continue
+        conn.settimeout(None)
+        return conn
+
+def run_trial(f, trial, name):
+    """Run this node's machines for one trial, as directed by the coordinator, then send back their logs."""
+    machines = {int(i): args for i, args in trial["machines"].items()}
+    # Logs are staged locally: on the coordinator's host they'd otherwise land in the folder they are gathered into
+    with tempfile.TemporaryDirectory() as log_folder:
+        # Our machines share this host's monotonic clock, but not the other nodes', so each gets the anchor
+        epoch_ns, mono_ns = time.time_ns(), time.monotonic_ns()
+        for i in machines:
+            write_run_anchor(log_folder, epoch_ns, mono_ns, machine_id=i)
+
+        start_barrier = StartBarrier(len(machines) + 1, timeout=NODE_TIMEOUT, hold=True)
+        processes = []
+        for i, args in machines.items():
+            p = multiprocessing.Process(target=run_machine, args=(dict(args, log_path=log_folder), *trial["probabilities"], start_barrier), daemon=True)
+            p.start()
+            processes.append(p)
+        try:
+            start_barrier.ready()
+            send_json(f, {"ready": True})
+        except threading.BrokenBarrierError:
+            send_json(f, {"error": f"a machine on node {name} failed to start"})
+
+        message = recv_json(f)
+        if message is not None and "start_ns" in message:
+            start_barrier.release(wall_to_monotonic(message["start_ns"]))
+            print(f"[NODE] {trial['run']}: started machines {sorted(machines)}")
+        else:
+            # A machine failed to start, here or on another node
+            start_barrier.abort()
+        if message is not None:
+            message = recv_json(f)
+
+        if message is not None:
+            time.sleep(max(0, message["stop_ns"] - time.time_ns()) / 1e9)
+        # SIGTERM lets each run loop flush and write its stats
+        for p in processes:
+            p.terminate()
+        for p in processes:
+            p.join()
+        if message is not None:
+            send_files(f, log_folder)
+
+def run_node(spec: ClusterSpec, machine_ids: list, name=None):
+    """Launch machine_ids of a cluster for every trial main.py runs, until it closes the connection."""
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    conn = connect(spec.coordinator)
+    f = conn.makefile("rwb")
+    send_json(f, {"node": name, "machines": machine_ids})
+    print(f"[NODE] {name} running machines {machine_ids} for {'{}:{}'.format(*spec.coordinator)}")
+    try:
+        while True:
+            message = recv_json(f)
+            if message is None:
+                return
+            if "error" in message:
+                raise RuntimeError(message["error"])
+            run_trial(f, message, name)
+    finally:
+        f.close()
+        conn.close()
+
+if __name__ == "__main__":
+    # python cluster.py CLUSTER_SPEC [HOST | ID,ID,...]: run all of the spec's machines, those on HOST, or the listed ones
+    if len(sys.argv) < 2:
+        print("Usage: python cluster.py CLUSTER_SPEC [HOST | ID,ID,...]")
+        sys.exit(1)
+    spec = ClusterSpec.load(sys.argv[1])
+    machine_ids = spec.select(sys.argv[2] if len(sys.argv) > 2 else None)
+    if not machine_ids:
+        print(f"No machines of {sys.argv[1]} on {sys.argv[2]}")
+        sys.exit(1)
+    run_node(spec, machine_ids)
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Formats for a machine's event log: text lines (machine_<id>.log) or newline-delimited JSON (machine_<id>.jsonl)
+LOG_FORMATS = {"text": "log", "ndjson": "jsonl"}
+
+# Per-run wall-clock anchor for the monotonic timestamps in text logs
+ANCHOR_FILE = "anchor.json"
+# Anchor of one machine, for runs whose machines ran on different hosts (and monotonic clocks)
+MACHINE_ANCHOR_FILE = "machine_{}_anchor.json"
+
+def write_run_anchor(log_path, epoch_ns=None, mono_ns=None, machine_id=None):
+    """Record one (wall clock, monotonic clock) reading for a run.
+
+    Every process on a host shares the monotonic clock, so this single reading maps
+    the Monotonic ns field of every machine's text log back to wall-clock time.
+    With machine_id it only covers that machine's log.
+    """
+    anchor = {
+        "epoch_ns": time.time_ns() if epoch_ns is None else epoch_ns,
+        "mono_ns": time.monotonic_ns() if mono_ns is None else mono_ns,
+    }
+    file_name = ANCHOR_FILE if machine_id is None else MACHINE_ANCHOR_FILE.format(machine_id)
+    with open(os.path.join(log_path, file_name), "w") as f:
+        json.dump(anchor, f)
+    return anchor
+
+def create_run_folder(name, logs_dir="logs"):
+    """Create and return a new run folder logs_dir/name, adding a suffix (_1, _2, ...) if that is taken.
+
+    Creation is atomic, so concurrent trials (or processes) never share a folder.
+    """
+    os.makedirs(logs_dir, exist_ok=True)
+    path = os.path.join(logs_dir, name)
+    n = 0
+    while True:
+        try:
+            os.mkdir(path)
+            return path
+        except FileExistsError:
+            n += 1
+            path = os.path.join(logs_dir, f"{name}_{n}")
+
+class EventLog:
+    """Machine event log written by a background thread, so recording an event never touches disk.
+
+    Events are appended to an in-memory buffer as tuples and a writer thread formats and
+    writes them in batches every flush_interval seconds. If the buffer holds capacity
+    records the newest record is dropped (and counted) rather than blocking the caller.
+    Records written more than late_after seconds after they were recorded are counted as late.
+    """
+    def __init__(self, log_path, machine_id, log_format="text", capacity=100_000, flush_interval=0.05, late_after=1.0):
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f"unknown log format {log_format!r}, expected one of {sorted(LOG_FORMATS)}")
+        if not os.path.exists(log_path):
+            os.makedirs(log_path)
+        self.machine_id = machine_id
+        self.log_format = log_format
+        self.path = f"{log_path}/machine_{machine_id}.{LOG_FORMATS[log_format]}"
+        self.file = open(self.path, "w")
+
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.late_after_ns = int(late_after * 1e9)
+        self.buffer = deque()
+        # Listener threads and the run loop record concurrently; the capacity check and counts must agree
+        self.lock = threading.Lock()
+
+        # Anchor monotonic timestamps to the wall clock once, for human-readable text logs
+        self.epoch_ns = time.time_ns()
+        self.mono_anchor_ns = time.monotonic_ns()
+        self._stamp_second = None
+        self._stamp = ""
+
+        # Writer statistics
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.late = 0
+        self.batches = 0
+        self.max_batch = 0
+
+        # Structured logs start with the anchor so readers can convert monotonic timestamps
+        if log_format == "ndjson":
+            self.file.write(json.dumps({"machine": machine_id, "op": "ANCHOR", "epoch_ns": self.epoch_ns, "mono_ns": self.mono_anchor_ns}) + "\n")
+
+        self._stop = threading.Event()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def event(self, op, logical_clock, queue_length=0, peer=None):
+        """Record a SENT / RECEIVED / INTERNAL event without blocking."""
+        self._append((op, time.monotonic_ns(), logical_clock, queue_length, peer, None))
+
+    def info(self, msg):
+        """Record a free-form line, e.g. [INIT] or [STATS]."""
+        self._append(("LOG", time.monotonic_ns(), None, None, None, msg))
+
+    error = info
+
+    def _append(self, record):
+        with self.lock:
+            self.recorded += 1
+            if len(self.buffer) >= self.capacity:
+                self.dropped += 1
+                return
+            self.buffer.append(record)
+
+    def _timestamp(self, mono_ns):
+        """Wall-clock timestamp (one-second resolution) for a monotonic time."""
+        second = (self.epoch_ns + mono_ns - self.mono_anchor_ns) // 1_000_000_000
+        if second != self._stamp_second:
+            self._stamp_second = second
+            self._stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+        return self._stamp
+
+    def _format(self, record):
+        op, mono_ns, clock, queue_length, peer, msg = record
+        if self.log_format == "ndjson":
+            if op == "LOG":
+                return json.dumps({"machine": self.machine_id, "op": op, "mono_ns": mono_ns, "msg": msg}) + "\n"
+            return json.dumps({"machine": self.machine_id, "op": op, "mono_ns": mono_ns, "logical_clock": clock,
+                               "queue_length": queue_length, "peer": peer}) + "\n"
+        if op == "SENT":
+            text = f"[SENT] to Machine {peer}, Logical clock: {clock}, Monotonic ns: {mono_ns}"
+        elif op == "RECEIVED":
+            text = f"[RECEIVED] from Machine {peer}, Logical clock: {clock}, Queue length: {queue_length}, Monotonic ns: {mono_ns}"
+        elif op == "INTERNAL":
+            text = f"[INTERNAL], Logical clock: {clock}, Monotonic ns: {mono_ns}"
+        else:
+            text = msg
+        return f"{self._timestamp(mono_ns)} - {text}\n"
+
+    def flush(self):
+        """Write everything buffered so far in one batch."""
+        batch = []
+        buffer = self.buffer
+        while buffer:
+            batch.append(buffer.popleft())
+        if not batch:
+            return
+        self.file.write("".join(map(self._format, batch)))
+        self.file.flush()
+
+        now = time.monotonic_ns()
+        self.late += sum(1 for r in batch if now - r[1] > self.late_after_ns)
+        self.written += len(batch)
+        self.batches += 1
+        self.max_batch = max(self.max_batch, len(batch))
+
+    def _write_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def summary(self):
+        """Writer statistics: records written, dropped and late, and batch sizes."""
+        return {
+            "format": self.log_format,
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "late": self.late,
+            "batches": self.batches,
+            "mean_batch_size": self.written / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch,
+        }
+
+    def close(self):
+        """Stop the writer, write any remaining records and close the file."""
+        if self.file.closed:
+            return
+        self._stop.set()
+        self.writer.join()
+        self.flush()
+        self.file.close()
@@ -0,0 +1,145 @@
+import json
+import os
+import sys
+import pandas as pd
+from log_parser import (
+    EVENT_OPS,
+    LOCAL_TZ,
+    find_machine_logs,
+    get_clock_rate,
+    iter_log_chunks,
+    load_anchor,
+    load_log_file,
+    parse_machine_log,
+)
+
+# Compacted events of a run, one row per event of every machine
+EVENTS_FILE = "events.parquet"
+
+# Bumped whenever the column layout below changes
+SCHEMA_VERSION = 2
+
+def _require_pyarrow():
+    """Import pyarrow, which is only needed for the columnar event store."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("the columnar event store needs pyarrow (pip install pyarrow)") from e
+    return pyarrow
+
+def event_schema(metadata: dict):
+    """Arrow schema of a compacted run; metadata values are stored as JSON."""
+    pa = _require_pyarrow()
+    return pa.schema([
+        ("machine", pa.int32()),
+        # Nanoseconds since the epoch: the machine's monotonic clock shifted by its wall-clock anchor
+        ("timestamp_ns", pa.int64()),
+        ("operation", pa.dictionary(pa.int8(), pa.string())),
+        ("logical_clock", pa.int64()),
+        ("queue_length", pa.int32()),
+        # The machine's own monotonic clock, for ordering events within a machine; null in older logs
+        ("mono_ns", pa.int64()),
+    ], metadata={k: json.dumps(v) for k, v in metadata.items()})
+
+def pa_int64(column):
+    """A nullable integer column as an Arrow int64 array."""
+    pa = _require_pyarrow()
+    return pa.array(pd.array(column, dtype="Int64"), pa.int64())
+
+def read_text_events(log_file: str, offset_ns=None):
+    """Events of a text machine log as (clock rate match, columns), parsed as a stream.
+
+    Each event's timestamp comes from its monotonic timestamp and the run's anchor offset
+    when both are available, and has one-second resolution otherwise.
+    """
+    with open(log_file, "r") as f:
+        cr = get_clock_rate(f.readline())
+        chunks = [df for _, df in iter_log_chunks(f)]
+    df = pd.concat(chunks, ignore_index=True) if chunks else parse_machine_log([])
+    timestamps = pd.to_datetime(df["timestamp"], format="%Y-%m-%d %H:%M:%S").dt.tz_localize(LOCAL_TZ)
+    # Newer pandas parses these to microseconds; count in nanoseconds like the monotonic path
+    timestamp_ns = timestamps.dt.as_unit("ns").astype("int64").to_numpy(copy=True)
+    if offset_ns is not None:
+        present = df["mono_ns"].notna().to_numpy()
+        timestamp_ns[present] = df["mono_ns"][present].to_numpy(dtype="int64") + offset_ns
+    return cr, {
+        "timestamp_ns": timestamp_ns,
+        "operation": df["operation"].to_numpy(),
+        "logical_clock": df["logical_clock"].to_numpy(),
+        "queue_length": df["queue_length"].to_numpy(),
+        "mono_ns": pa_int64(df["mono_ns"]),
+    }
+
+def read_ndjson_events(lines: list):
+    """Events of an ndjson machine log as (clock rate match, columns), keeping nanosecond timestamps."""
+    records = [json.loads(l) for l in lines if l.strip()]
+    anchor = next(r for r in records if r["op"] == "ANCHOR")
+    offset_ns = anchor["epoch_ns"] - anchor["mono_ns"]
+    init = next(r for r in records if r["op"] == "LOG" and "[INIT]" in r["msg"])
+
+    events = [r for r in records if r["op"] in EVENT_OPS]
+    return get_clock_rate(init["msg"]), {
+        "timestamp_ns": [r["mono_ns"] + offset_ns for r in events],
+        "operation": [r["op"] for r in events],
+        "logical_clock": [r["logical_clock"] for r in events],
+        "queue_length": [r["queue_length"] or 0 for r in events],
+        "mono_ns": [r["mono_ns"] for r in events],
+    }
+
+def compact_run(log_path):
+    """Compact every machine log of a run into one typed Parquet file and return its path.
+
+    The clock rates are kept in the file's schema metadata, so analysis needs neither
+    the logs, the per-machine CSVs nor clock_rates.json.
+    """
+    pa = _require_pyarrow()
+    tables = []
+    clock_rates = {}
+    for i, file_name in find_machine_logs(log_path).items():
+        offset_ns = load_anchor(log_path, i)
+        if file_name.endswith(".jsonl"):
+            cr, columns = read_ndjson_events(load_log_file(os.path.join(log_path, file_name)))
+        else:
+            cr, columns = read_text_events(os.path.join(log_path, file_name), offset_ns)
+        clock_rates[f"machine_{i}"] = int(cr.group(1))
+        n = len(columns["operation"])
+        tables.append(pa.table({"machine": pa.array([i] * n, pa.int32()), **columns}))
+
+    schema = event_schema({"schema_version": SCHEMA_VERSION, "clock_rates": clock_rates})
+    # Cast to the schema so empty logs and Python lists end up with the same column types
+    table = pa.concat_tables([t.cast(schema.remove_metadata()) for t in tables]).replace_schema_metadata(schema.metadata)
+    out_path = os.path.join(log_path, EVENTS_FILE)
+    pa.parquet.write_table(table, out_path)
+    return out_path
+
+def load_events(log_path):
+    """Load a compacted run as (clock rates, per-machine dataframes ordered by machine id).
+
+    Dataframes have the columns of the parsed CSVs, with timestamp already a (local) datetime;
+    like the CSVs they still go through analysis.preprocess.
+    """
+    pa = _require_pyarrow()
+    table = pa.parquet.read_table(os.path.join(log_path, EVENTS_FILE))
+    metadata = {k.decode(): json.loads(v) for k, v in (table.schema.metadata or {}).items()}
+    if metadata.get("schema_version") != SCHEMA_VERSION:
+        raise ValueError(f"unsupported event store schema version {metadata.get('schema_version')!r}")
+    clock_rates = metadata["clock_rates"]
+
+    df = table.to_pandas()
+    df["timestamp"] = pd.to_datetime(df.pop("timestamp_ns"), unit="ns", utc=True).dt.tz_convert(LOCAL_TZ).dt.tz_localize(None)
+    df = df[["machine", "timestamp", "operation", "logical_clock", "queue_length", "mono_ns"]]
+    groups = dict(tuple(df.groupby("machine", sort=True)))
+    dataframes = []
+    for key in sorted(clock_rates, key=lambda k: int(k.split("_")[1])):
+        i = int(key.split("_")[1])
+        machine_df = groups[i] if i in groups else df.iloc[0:0]
+        dataframes.append(machine_df.drop(columns="machine").reset_index(drop=True))
+    return clock_rates, dataframes
+
+if __name__ == "__main__":
+    # Usage: python event_store.py <PATH_TO_LOG>
+    if len(sys.argv) < 2:
+        print("Please provide the log path.")
+        sys.exit(1)
+    print(f"Compacted events -> {compact_run(sys.argv[1])}")
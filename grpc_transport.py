@@ -0,0 +1,99 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import grpc
+from google.protobuf import empty_pb2
+import system_pb2
+import system_pb2_grpc
+from wire import Message
+
+STREAM_METHOD = "/machine.PeerService/StreamMessages"
+
+# Batches buffered per peer stream; when gRPC's HTTP/2 flow control stops draining
+# them (the peer reads slower than we write), send() blocks
+STREAM_BUFFER = 1024
+
+def encode_message(message: Message) -> bytes:
+    """A message as a serialized one-message MessageBatch.
+
+    Concatenated serializations of a repeated field parse as a single batch of all the
+    messages, so a batcher can join encoded messages just like binary frames.
+    """
+    return system_pb2.MessageBatch(messages=[system_pb2.Message(
+        sender_id=message.sender_id,
+        logical_clock=message.logical_clock,
+        send_ns=message.send_ns or 0,
+        seq=-1 if message.seq is None else message.seq,
+    )]).SerializeToString()
+
+def decode_batch(batch) -> list:
+    """Messages of a received MessageBatch."""
+    return [Message(m.sender_id, m.logical_clock, m.send_ns or None, None if m.seq < 0 else m.seq) for m in batch.messages]
+
+def grpc_server(servicer, host: str, port: int, max_workers: int):
+    """Unstarted gRPC server for a machine's PeerService; each inbound stream holds a worker."""
+    server = grpc.server(ThreadPoolExecutor(max_workers=max_workers))
+    system_pb2_grpc.add_PeerServiceServicer_to_server(servicer, server)
+    server.add_insecure_port(f"{host}:{port}")
+    return server
+
+class GrpcPeerStream:
+    """Long-lived client stream of message batches to a single peer over one HTTP/2 channel."""
+    def __init__(self, host: str, port: int, buffer=STREAM_BUFFER):
+        self.address = f"{host}:{port}"
+        self.buffer = buffer
+        self.channel = grpc.insecure_channel(self.address)
+        # Batches are serialized by the sender already, so they pass through as bytes
+        self.method = self.channel.stream_unary(STREAM_METHOD, request_serializer=None,
+                                                response_deserializer=empty_pb2.Empty.FromString)
+        self.lock = threading.Lock()
+        self.queue = None
+        self.call = None
+
+    def _open(self):
+        self.queue = queue.Queue(self.buffer)
+        # Wait for the peer to come up rather than failing the stream straight away
+        self.call = self.method.future(iter(self.queue.get, None), wait_for_ready=True)
+
+    def send(self, data: bytes):
+        """Queue serialized batches on the stream, opening a new one if the last has ended."""
+        with self.lock:
+            if self.call is None:
+                self._open()
+            elif self.call.done():
+                # The peer went away or restarted: report it, and stream afresh from the next send
+                code = self.call.code()
+                self._open()
+                raise ConnectionError(f"stream to peer {self.address} ended: {code}")
+            self.queue.put(data)
+
+    def close(self):
+        with self.lock:
+            if self.call is not None:
+                try:
+                    # End the stream cleanly so the peer sees every queued batch
+                    self.queue.put_nowait(None)
+                    self.call.result(timeout=1)
+                except Exception:
+                    pass
+            self.channel.close()
+
+class GrpcPeerPool:
+    """Pool of gRPC streams, one per peer index; a drop-in for transport.PeerPool."""
+    def __init__(self, addresses: list):
+        # addresses: list of (host, port) tuples, indexed like Machine.peers
+        self.connections = [GrpcPeerStream(host, port) for host, port in addresses]
+
+    def encode(self, message: Message) -> bytes:
+        return encode_message(message)
+
+    def send(self, target: int, data: bytes):
+        self.connections[target].send(data)
+
+    def take_credit(self, target: int):
+        # HTTP/2 flow control paces the streams; there are no credits to take
+        return True
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
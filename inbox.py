@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import deque
+
+# What a full inbox does with new messages: block the producer (and so, through TCP, the
+# sender), drop the oldest queued message, drop the new one, or rely on the sender only
+# sending with credits we granted (new messages beyond capacity are dropped as a safety net)
+INBOX_POLICIES = ("block", "drop_oldest", "drop_newest", "credit")
+
+class Inbox:
+    """In-process message queue shared by the listener threads and the run loop.
+
+    Unbounded by default; with a capacity, the overload policy decides what happens when
+    it is full, and drops, time spent blocked and the high-water mark are counted.
+    """
+    def __init__(self, capacity=None, policy="block"):
+        if policy not in INBOX_POLICIES:
+            raise ValueError(f"unknown inbox policy {policy!r}, expected one of {INBOX_POLICIES}")
+        if policy == "credit" and capacity is None:
+            raise ValueError("credit flow control needs an inbox capacity")
+        self.items = deque()
+        self.capacity = capacity
+        self.policy = policy
+        self.blocking = capacity is not None and policy == "block"
+        self.closed = False
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+        # Overload statistics
+        self.high_water = 0
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.blocked_puts = 0
+        self.blocked_ns = 0
+
+    def put(self, item):
+        """Append a message and wake any waiting consumer."""
+        if self.capacity is not None:
+            self.put_many((item,))
+            return
+        with self.lock:
+            queue = self.items
+            queue.append(item)
+            if len(queue) > self.high_water:
+                self.high_water = len(queue)
+            self.not_empty.notify()
+
+    def put_many(self, items):
+        """Append several messages under a single lock acquisition (per wait, when blocking).
+
+        Returns the messages dropped to make room or for lack of it.
+        """
+        dropped = []
+        with self.lock:
+            queue = self.items
+            if self.capacity is None or len(queue) + len(items) <= self.capacity:
+                queue.extend(items)
+            else:
+                self._put_bounded(items, dropped)
+            if len(queue) > self.high_water:
+                self.high_water = len(queue)
+            self.not_empty.notify()
+        return dropped
+
+    def _put_bounded(self, items, dropped):
+        # Called with the lock held when items would overflow the inbox
+        queue = self.items
+        for n, item in enumerate(items):
+            if len(queue) >= self.capacity:
+                if self.policy == "block":
+                    # Let the consumer see what we queued so far, then wait for room
+                    self.high_water = max(self.high_water, len(queue))
+                    self.not_empty.notify()
+                    self.blocked_puts += 1
+                    start = time.monotonic_ns()
+                    self.not_full.wait_for(lambda: len(queue) < self.capacity or self.closed)
+                    self.blocked_ns += time.monotonic_ns() - start
+                    if self.closed:
+                        self.dropped_newest += len(items) - n
+                        dropped.extend(items[n:])
+                        return
+                elif self.policy == "drop_oldest":
+                    dropped.append(queue.popleft())
+                    self.dropped_oldest += 1
+                else:
+                    dropped.append(item)
+                    self.dropped_newest += 1
+                    continue
+            queue.append(item)
+
+    def close(self):
+        """Release producers blocked on a full inbox; later overflow is dropped."""
+        with self.lock:
+            self.closed = True
+            self.not_full.notify_all()
+            self.not_empty.notify_all()
+
+    def get(self, timeout=None):
+        """Remove and return the oldest message, waiting up to timeout; None if none arrived."""
+        with self.lock:
+            if not self.items and not self.not_empty.wait_for(lambda: self.items, timeout):
+                return None
+            item = self.items.popleft()
+            self._made_room()
+            return item
+
+    def pop(self):
+        """Remove the oldest message without waiting and return (message, remaining length).
+
+        Returns (None, 0) when the inbox is empty.
+        """
+        with self.lock:
+            if not self.items:
+                return None, 0
+            item = self.items.popleft()
+            self._made_room()
+            return item, len(self.items)
+
+    def drain(self, max_items=None):
+        """Remove and return up to max_items ready messages (all of them if None), oldest first."""
+        return self.pop_many(max_items)[0]
+
+    def pop_many(self, max_items=None):
+        """Like drain, but also return the length left behind: (messages, remaining length)."""
+        with self.lock:
+            items = self.items
+            if max_items is None or max_items >= len(items):
+                batch = list(items)
+                items.clear()
+            else:
+                popleft = items.popleft
+                batch = [popleft() for _ in range(max_items)]
+            if batch:
+                self._made_room()
+            return batch, len(items)
+
+    def _made_room(self):
+        # Called with the lock held after removing messages
+        if self.blocking:
+            self.not_full.notify_all()
+
+    def summary(self):
+        """Capacity, overload policy, high-water mark, drops and time producers spent blocked."""
+        return {
+            "capacity": self.capacity,
+            "policy": self.policy,
+            "high_water": self.high_water,
+            "dropped_oldest": self.dropped_oldest,
+            "dropped_newest": self.dropped_newest,
+            "blocked_puts": self.blocked_puts,
+            "blocked_ms": self.blocked_ns / 1e6,
+        }
+
+    def empty(self):
+        return not self.items
+
+    def qsize(self):
+        return len(self.items)
+
+    def __len__(self):
+        return len(self.items)
@@ -0,0 +1,105 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import log_parser
+from event_store import EVENTS_FILE
+from log_parser import MACHINE_LOG_PATTERN
+
+# Fingerprints of the logs of every ingested run, kept in the logs folder
+MANIFEST_FILE = "ingest_manifest.json"
+
+def discover_runs(logs_dir):
+    """Return the run folders under logs_dir that contain at least one machine log, sorted by name."""
+    runs = []
+    for name in sorted(os.listdir(logs_dir)):
+        path = os.path.join(logs_dir, name)
+        if os.path.isdir(path) and any(MACHINE_LOG_PATTERN.match(f) for f in os.listdir(path)):
+            runs.append(name)
+    return runs
+
+def run_fingerprint(run_path):
+    """{log file name: [mtime_ns, size]} for every machine log in a run."""
+    fingerprint = {}
+    for f in sorted(os.listdir(run_path)):
+        if MACHINE_LOG_PATTERN.match(f):
+            st = os.stat(os.path.join(run_path, f))
+            fingerprint[f] = [st.st_mtime_ns, st.st_size]
+    return fingerprint
+
+def load_manifest(logs_dir):
+    path = os.path.join(logs_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_manifest(logs_dir, manifest):
+    # Write then rename, so an interrupted ingest never leaves a truncated manifest
+    path = os.path.join(logs_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def ingest_run(run_path, compact=False):
+    """Parse one run (and optionally compact it into events.parquet); returns seconds taken."""
+    start = time.perf_counter()
+    log_parser.main(run_path)
+    if compact:
+        from event_store import compact_run
+        compact_run(run_path)
+    return time.perf_counter() - start
+
+def ingest(logs_dir, workers=None, force=False, compact=False):
+    """Parse every run under logs_dir whose logs changed since the last ingest, in parallel.
+
+    A run is skipped if its machine logs have the same modification times and sizes as
+    recorded in the manifest and its clock_rates.json (and with compact, its events.parquet)
+    is still there. Returns
+    {"ingested": [...], "skipped": [...], "failed": {run: error}}.
+    """
+    manifest = {} if force else load_manifest(logs_dir)
+    result = {"ingested": [], "skipped": [], "failed": {}}
+
+    stale = {}
+    for run in discover_runs(logs_dir):
+        run_path = os.path.join(logs_dir, run)
+        fingerprint = run_fingerprint(run_path)
+        outputs = ["clock_rates.json"] + ([EVENTS_FILE] if compact else [])
+        if manifest.get(run) == fingerprint and all(os.path.exists(os.path.join(run_path, f)) for f in outputs):
+            result["skipped"].append(run)
+        else:
+            stale[run] = fingerprint
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(ingest_run, os.path.join(logs_dir, run), compact): run for run in stale}
+            for future in as_completed(futures):
+                run = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    result["failed"][run] = f"{type(e).__name__}: {e}"
+                    manifest.pop(run, None)
+                    continue
+                result["ingested"].append(run)
+                manifest[run] = stale[run]
+        save_manifest(logs_dir, manifest)
+
+    result["ingested"].sort()
+    return result
+
+if __name__ == "__main__":
+    # Usage: python ingest.py [LOGS_DIR] [WORKERS] [--force] [--compact]
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    logs_dir = args[0] if args else "logs"
+    workers = int(args[1]) if len(args) > 1 else None
+
+    start = time.perf_counter()
+    result = ingest(logs_dir, workers, force="--force" in sys.argv, compact="--compact" in sys.argv)
+    elapsed = time.perf_counter() - start
+    for run, error in sorted(result["failed"].items()):
+        print(f"Failed {run}: {error}")
+    print(f"Ingested {len(result['ingested'])} runs, skipped {len(result['skipped'])} unchanged, "
+          f"{len(result['failed'])} failed in {elapsed:.1f}s")
@@ -0,0 +1,103 @@
+import math
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram in nanoseconds: 16 buckets per power of two (under 5% error).
+
+    Count, mean and max are exact; percentiles are the upper edge of the bucket they fall in.
+    """
+    SUB_BUCKETS = 16
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, ns):
+        # Clocks on different hosts can disagree; treat negative latencies as zero
+        ns = max(ns, 0)
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+        bucket = int(math.log2(ns) * self.SUB_BUCKETS) if ns >= 1 else -1
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, q):
+        """Latency below which q percent of samples fall, in nanoseconds."""
+        if not self.count:
+            return 0
+        target = q / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                upper = 0 if bucket < 0 else 2 ** ((bucket + 1) / self.SUB_BUCKETS)
+                return min(upper, self.max)
+        return self.max
+
+    def summary(self):
+        """count plus mean / p50 / p99 / max in milliseconds."""
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count / 1e6 if self.count else 0.0,
+            "p50_ms": self.percentile(50) / 1e6,
+            "p99_ms": self.percentile(99) / 1e6,
+            "max_ms": self.max / 1e6,
+        }
+
+class LatencyStats:
+    """Per-machine message latency by stage, and loss / reordering per sender.
+
+    Stages of a received message, from its monotonic timestamps:
+    network (send -> enqueue in our inbox), queue (enqueue -> dequeue by the run loop),
+    apply (dequeue -> Lamport update) and end_to_end (send -> Lamport update).
+    Each sender numbers its messages to us 0, 1, 2, ...; a gap in the numbers counts the
+    missing messages as lost until they arrive late, when they count as reordered instead.
+    """
+    STAGES = ("network", "queue", "apply", "end_to_end")
+
+    def __init__(self):
+        self.histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+        self.received = {}
+        self.next_seq = {}
+        self.lost = {}
+        self.reordered = {}
+
+    def record(self, message, dequeue_ns, apply_ns):
+        """Record a message once the run loop has applied it."""
+        h = self.histograms
+        if message.enqueue_ns is not None:
+            h["queue"].add(dequeue_ns - message.enqueue_ns)
+            if message.send_ns is not None:
+                h["network"].add(message.enqueue_ns - message.send_ns)
+        h["apply"].add(apply_ns - dequeue_ns)
+        if message.send_ns is not None:
+            h["end_to_end"].add(apply_ns - message.send_ns)
+
+        sender = message.sender_id
+        self.received[sender] = self.received.get(sender, 0) + 1
+        if message.seq is None:
+            return
+        expected = self.next_seq.get(sender, 0)
+        if message.seq >= expected:
+            # Anything skipped over is missing, for now
+            self.lost[sender] = self.lost.get(sender, 0) + message.seq - expected
+            self.next_seq[sender] = message.seq + 1
+        else:
+            # A message we had given up on arrived late
+            self.lost[sender] = self.lost.get(sender, 0) - 1
+            self.reordered[sender] = self.reordered.get(sender, 0) + 1
+
+    def summary(self):
+        """Stage latency summaries, plus received / lost / reordered totals and per sender."""
+        senders = sorted(self.received)
+        return {
+            **{stage: h.summary() for stage, h in self.histograms.items()},
+            "received": sum(self.received.values()),
+            "lost": sum(self.lost.values()),
+            "reordered": sum(self.reordered.values()),
+            "per_sender": {str(s): {"received": self.received[s],
+                                    "lost": self.lost.get(s, 0),
+                                    "reordered": self.reordered.get(s, 0)} for s in senders},
+        }
@@ -1,11 +1,46 @@
+import os
 import re
 import sys
 import json
+import time
+import datetime
+from itertools import islice
+import numpy as np
 import pandas as pd
+import yaml
 
 # Pattern to match timestamps from log
 TIMESTAMP_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
 
+# Machines in a run that does not record N_MACHINES (the original fixed cluster)
+LEGACY_N_MACHINES = 3
+
+# Machine log files in a run folder: machine_<id>.log (text) or machine_<id>.jsonl (ndjson)
+MACHINE_LOG_PATTERN = re.compile(r"^machine_(\d+)\.(log|jsonl)$")
+
+# Columns of a parsed machine log; mono_ns is empty for logs written before it was recorded
+COLUMNS = ["timestamp", "operation", "logical_clock", "queue_length", "mono_ns"]
+
+# Per-run anchor mapping monotonic timestamps to the wall clock (see event_log.write_run_anchor),
+# overridden by a per-machine one for machines launched on another host
+ANCHOR_FILE = "anchor.json"
+MACHINE_ANCHOR_FILE = "machine_{}_anchor.json"
+
+# Wall-clock timestamps in logs are local time
+LOCAL_TZ = datetime.datetime.now().astimezone().tzinfo
+
+# Operations that become rows; other lines (errors, [STATS] summaries) are skipped
+EVENT_OPS = ("SENT", "RECEIVED", "INTERNAL")
+
+# An event line in a single match: timestamp, operation, logical clock, (for RECEIVED) queue length
+# and the monotonic timestamp
+EVENT_LINE_PATTERN = re.compile(
+    r"(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) - \[(SENT|RECEIVED|INTERNAL)\][^L\n]*Logical clock: (\d+)"
+    r"(?:, Queue length: (\d+))?(?:, Monotonic ns: (\d+))?")
+
+# Lines parsed at a time when streaming a log
+CHUNK_LINES = 100_000
+
 def load_log_file(log_file: str):
     """Load the log file and return the log entries."""
     with open(log_file, "r") as f:
@@ -19,62 +54,181 @@ def get_clock_rate(init_line: str):
     cr = re.search(r"with clock rate (\d+)", init_line)
     return cr
 
-def parse_machine_log(lines: list):
-    """Parse machine log into a dataframe"""
-    # Initialize the list of rows
-    row_list = []
-    
-    # Parse each line
+def _parse_line_slow(l: str):
+    """Parse a line that is not a well-formed event: a non-event line, or one with a bad timestamp."""
+    # Get values
+    timestamp = TIMESTAMP_PATTERN.search(l).group(0)
+    op_match = re.search(r"\[(\w+)\]", l)
+    if op_match is None or op_match.group(1) not in EVENT_OPS:
+        return None
+    operation = op_match.group(1)
+    logical_clock = str(int(re.search(r"Logical clock: (\d+)", l).group(1)))
+    queue_length = None
+    if operation == "RECEIVED":
+        queue_length = str(int(re.search(r"Queue length: (\d+)", l).group(1)))
+    mono_match = re.search(r"Monotonic ns: (\d+)", l)
+    return timestamp, operation, logical_clock, queue_length, mono_match and mono_match.group(1)
+
+def load_anchor(log_path, machine_id=None):
+    """Offset (ns) from the monotonic clock to the wall clock for a run (or one of its machines), or None if it has no anchor."""
+    path = os.path.join(log_path, ANCHOR_FILE)
+    if machine_id is not None and os.path.exists(os.path.join(log_path, MACHINE_ANCHOR_FILE.format(machine_id))):
+        path = os.path.join(log_path, MACHINE_ANCHOR_FILE.format(machine_id))
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        anchor = json.load(f)
+    return anchor["epoch_ns"] - anchor["mono_ns"]
+
+def wall_timestamps(mono_ns, offset_ns):
+    """Local wall-clock timestamp strings, to the nanosecond, for monotonic timestamps."""
+    timestamps = pd.to_datetime(np.asarray(mono_ns, dtype=np.int64) + offset_ns, unit="ns", utc=True)
+    return timestamps.tz_convert(LOCAL_TZ).tz_localize(None).astype(str).tolist()
+
+def _parse_lines(lines, offset_ns=None):
+    """Parse log lines into a dataframe with typed columns, matching each line once.
+
+    With the run's anchor offset, events that carry a monotonic timestamp get a
+    nanosecond wall-clock timestamp instead of the line's one-second one. mono_ns is
+    nullable (Int64) whether or not every line has one, so all chunks of a log agree.
+    """
+    timestamps, operations, clocks, queue_lengths, monos = [], [], [], [], []
+    match = EVENT_LINE_PATTERN.match
     for l in lines:
+        m = match(l)
+        if m is not None:
+            timestamp, operation, logical_clock, queue_length, mono = m.groups()
+        else:
+            row = _parse_line_slow(l)
+            if row is None:
+                continue
+            timestamp, operation, logical_clock, queue_length, mono = row
+        timestamps.append(timestamp)
+        operations.append(operation)
+        clocks.append(logical_clock)
+        # Only RECEIVED lines carry a queue length
+        queue_lengths.append(queue_length or "0")
+        monos.append(mono)
 
-        # Get values
-        try:
-            timestamp = TIMESTAMP_PATTERN.search(l).group(0)
-            operation = re.search(r"\[(\w+)\]", l).group(1)
-            logical_clock = int(re.search(r"Logical clock: (\d+)", l).group(1))
-            queue_length = 0
-            if operation == "RECEIVED":
-                queue_length = int(re.search(r"Queue length: (\d+)", l).group(1))
-    
-            # Append to the list of rows
-            row_list.append([timestamp,operation,logical_clock,queue_length])
-        except ValueError as e:
-            return e
-    
-    # Create a dataframe
-    df = pd.DataFrame(row_list)
-    # Give df column names in place
-    df.columns = ["timestamp", "operation", "logical_clock", "queue_length"]
-    return df
+    # Older logs have no monotonic timestamps; keep the column, empty where they are missing
+    if None in monos:
+        mono_ns = pd.array([int(x) if x else None for x in monos], dtype="Int64")
+    else:
+        mono_ns = pd.array(np.array(monos, dtype=np.int64), dtype="Int64")
+    present = ~mono_ns.isna()
+    if offset_ns is not None and present.any():
+        wall = wall_timestamps(mono_ns[present].to_numpy(dtype=np.int64), offset_ns)
+        if present.all():
+            timestamps = wall
+        else:
+            for i, timestamp in zip(np.flatnonzero(present), wall):
+                timestamps[i] = timestamp
+
+    return pd.DataFrame({
+        "timestamp": timestamps,
+        "operation": pd.Categorical(operations, categories=EVENT_OPS),
+        "logical_clock": np.array(clocks, dtype=np.int64),
+        "queue_length": np.array(queue_lengths, dtype=np.int64),
+        "mono_ns": mono_ns,
+    }, columns=COLUMNS)
+
+def parse_machine_log(lines: list, offset_ns=None):
+    """Parse machine log into a dataframe"""
+    try:
+        return _parse_lines(lines, offset_ns)
+    except ValueError as e:
+        return e
+
+def iter_log_chunks(lines, chunk_lines=CHUNK_LINES, offset_ns=None):
+    """Parse an iterable of log lines (e.g. an open file) chunk_lines at a time.
+
+    Yields (lines read, dataframe of the chunk's events), so a log of any size is
+    parsed in bounded memory.
+    """
+    lines = iter(lines)
+    while True:
+        block = list(islice(lines, chunk_lines))
+        if not block:
+            return
+        yield len(block), _parse_lines(block, offset_ns)
+
+def stream_log_to_csv(log_file: str, csv_file: str, chunk_lines=CHUNK_LINES, offset_ns=None):
+    """Parse a text machine log into a CSV chunk by chunk; returns (clock rate match, lines read, seconds taken)."""
+    start = time.perf_counter()
+    with open(log_file, "r") as f, open(csv_file, "w", newline="") as out:
+        # Get the clock rate from the first line
+        first = f.readline()
+        cr = get_clock_rate(first)
+        n_lines = 1 if first else 0
+        header = True
+        for n, df in iter_log_chunks(f, chunk_lines, offset_ns):
+            df.to_csv(out, index=False, header=header)
+            header = False
+            n_lines += n
+        # An empty log still gets a CSV with the column names
+        if header:
+            out.write(",".join(COLUMNS) + "\n")
+    return cr, n_lines, time.perf_counter() - start
+
+def parse_event_records(lines: list):
+    """Parse an ndjson machine log into (clock rate match, dataframe) with the same columns as parse_machine_log"""
+    records = [json.loads(l) for l in lines if l.strip()]
+
+    # The anchor record maps monotonic timestamps back to the wall clock
+    anchor = next(r for r in records if r["op"] == "ANCHOR")
+    offset_ns = anchor["epoch_ns"] - anchor["mono_ns"]
+    init = next(r for r in records if r["op"] == "LOG" and "[INIT]" in r["msg"])
+
+    events = [r for r in records if r["op"] in EVENT_OPS]
+    mono_ns = [r["mono_ns"] for r in events]
+    df = pd.DataFrame({
+        "timestamp": wall_timestamps(mono_ns, offset_ns),
+        "operation": pd.Categorical([r["op"] for r in events], categories=EVENT_OPS),
+        "logical_clock": np.array([r["logical_clock"] for r in events], dtype=np.int64),
+        "queue_length": np.array([r["queue_length"] or 0 for r in events], dtype=np.int64),
+        "mono_ns": pd.array(mono_ns, dtype="Int64"),
+    }, columns=COLUMNS)
+    return get_clock_rate(init["msg"]), df
+
+def find_machine_logs(log_path):
+    """Return {machine id: log file name} for a run, checked against the run's config.yaml if present."""
+    logs = {int(m.group(1)): m.group(0) for m in map(MACHINE_LOG_PATTERN.match, sorted(os.listdir(log_path))) if m}
+    machine_ids = sorted(logs)
+
+    # Every machine the run recorded in its config.yaml must have a log. Runs that don't
+    # record N_MACHINES predate it: they had machines 0 to 2, or as many as there are logs
+    n_machines = None
+    config_path = os.path.join(log_path, "config.yaml")
+    if os.path.exists(config_path):
+        with open(config_path, "r") as f:
+            n_machines = (yaml.safe_load(f) or {}).get("N_MACHINES")
+    if n_machines is None:
+        n_machines = max([LEGACY_N_MACHINES - 1] + machine_ids) + 1
+    for i in range(n_machines):
+        if i not in machine_ids:
+            raise FileNotFoundError(f"{log_path}/machine_{i}.log")
+    return {i: logs[i] for i in machine_ids}
 
 def main(log_path):
     """Main function to parse the log files for a single run."""
+    clock_rates = {}
+    for i, file_name in find_machine_logs(log_path).items():
+        offset_ns = load_anchor(log_path, i)
+        csv_file = f"{log_path}/machine_{i}.csv"
+        if file_name.endswith(".jsonl"):
+            logs = load_log_file(f"{log_path}/{file_name}")
+            cr, df = parse_event_records(logs)
+            # Save tabular dataset for the machine to csv
+            df.to_csv(csv_file, index=False)
+        else:
+            cr, n_lines, elapsed = stream_log_to_csv(f"{log_path}/{file_name}", csv_file, offset_ns=offset_ns)
+            print(f"{file_name}: {n_lines:,} lines in {elapsed:.2f}s ({n_lines / max(elapsed, 1e-9):,.0f} lines/s)")
+        clock_rates[f"machine_{i}"] = int(cr.group(1))
 
-    # Load log files
-    m0_logs = load_log_file(f"{log_path}/machine_0.log")
-    m1_logs = load_log_file(f"{log_path}/machine_1.log")
-    m2_logs = load_log_file(f"{log_path}/machine_2.log")
-
-    # Get clock rate for each machine
-    cr0 = get_clock_rate(m0_logs.pop(0))
-    cr1 = get_clock_rate(m1_logs.pop(0))
-    cr2 = get_clock_rate(m2_logs.pop(0))
-    
     # Save clock rates to json for legibility
-    clock_rates = {"machine_0": int(cr0.group(1)),
-                   "machine_1": int(cr1.group(1)),
-                   "machine_2": int(cr2.group(1))}
     with open(f"{log_path}/clock_rates.json", "w") as f:
         json.dump(clock_rates, f)
 
-    # Create tabular datasets for each machine and save to csv
-    df0 = parse_machine_log(m0_logs)
-    df1 = parse_machine_log(m1_logs)
-    df2 = parse_machine_log(m2_logs)
-    df0.to_csv(f"{log_path}/machine_0.csv", index=False)
-    df1.to_csv(f"{log_path}/machine_1.csv", index=False)
-    df2.to_csv(f"{log_path}/machine_2.csv", index=False)
-
 if __name__ == "__main__":
     # Get CLI args
     if len(sys.argv) > 1:
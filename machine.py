@@ -14,25 +14,72 @@ from google.protobuf import empty_pb2
 from multiprocessing import Queue
 import multiprocessing
 import json
+import signal
+from transport import CreditLink, PeerPool, SendBatcher, peer_address
+from grpc_transport import GrpcPeerPool, decode_batch, grpc_server
+from shm_transport import ShmInbound, ShmPeerPool, check_platform
+from wire import Message, FrameDecoder
+from inbox import Inbox
+from topology import ActionModel
+from event_log import EventLog
+from latency import LatencyStats
+from scheduler import TickScheduler
+from metrics import MetricsServer, render_metrics
 
-class Message:
-    """Class to represent a message sent between machines."""
-    def __init__(self, sender_id, logical_clock):
-        self.sender_id = sender_id
-        self.logical_clock = logical_clock
+# How many queued messages a tick handles: one (the original behaviour), up to process_batch
+# applied one by one ("batch"), or all of them with a single Lamport update ("drain")
+PROCESS_POLICIES = ("one", "batch", "drain")
 
-    def to_json(self):
-        # Convert the message to a JSON string
-        return json.dumps(self.__dict__)
+# How messages travel between machines: length-prefixed frames on raw TCP streams,
+# client-streaming PeerService.StreamMessages calls on persistent gRPC (HTTP/2) channels,
+# or shared-memory ring buffers between machines on the same host
+TRANSPORTS = ("socket", "grpc", "shm")
 
-    @staticmethod
-    def from_json(json_string):
-        # Create a message object from a JSON string
-        data = json.loads(json_string)
-        return Message(data["sender_id"], data["logical_clock"])
+def process_limit(policy, batch_size):
+    """Most messages a tick takes from the inbox under a processing policy (None for no limit)."""
+    if policy not in PROCESS_POLICIES:
+        raise ValueError(f"unknown processing policy {policy!r}, expected one of {PROCESS_POLICIES}")
+    return {"one": 1, "batch": batch_size, "drain": None}[policy]
+
+# Messages per tick under the batch policy, unless PROCESS_BATCH says otherwise
+DEFAULT_PROCESS_BATCH = 4
+
+def apply_received(machine, messages, queue_length, drain):
+    """Apply a tick's messages to a machine's logical clock, and log each with the queue length behind it.
+
+    drain: a single Lamport update for all of them; otherwise one per message. Shared by
+    Machine and AsyncMachine, so both runtimes process messages identically.
+    """
+    dequeue_ns = time.monotonic_ns()
+    if drain:
+        # Update clock according to Lamport, once, with the largest clock in the batch
+        machine.logical_clock = max(machine.logical_clock, max(m.logical_clock for m in messages)) + 1
+    for i, message in enumerate(messages):
+        if not drain:
+            # Update clock according to Lamport
+            machine.logical_clock = max(machine.logical_clock, message.logical_clock) + 1
+        machine.latency.record(message, dequeue_ns, time.monotonic_ns())
+
+        # Log the message with the queue length behind it
+        machine.logger.event("RECEIVED", machine.logical_clock, queue_length + len(messages) - i - 1, message.sender_id)
+
+def setup_logger(log_path, machine_id, log_format="text"):
+    """Create the background-written event log for a machine."""
+    return EventLog(log_path, machine_id, log_format)
+
+def run_machine(machine_args: dict, p_a, p_b, p_c, start_barrier=None):
+    """Process entry point: create a machine from its constructor arguments and run it"""
+    try:
+        machine = Machine(**machine_args)
+    except Exception:
+        # Don't leave the rest of the cluster waiting for us until the barrier times out
+        if start_barrier is not None:
+            start_barrier.abort()
+        raise
+    machine.run(p_a, p_b, p_c, start_barrier)
 
 class Machine(system_pb2_grpc.PeerServiceServicer):
-    def __init__(self, machine_id: int, host: str, port: int, clock_rate: int, peers: list, peers_id: list, log_path=None):
+    def __init__(self, machine_id: int, host: str, port: int, clock_rate: int, peers: list, peers_id: list, log_path=None, flush_window=0.0, peer_weights=None, log_format="text", tick_policy="skip", process_policy="one", process_batch=DEFAULT_PROCESS_BATCH, inbox_capacity=None, inbox_policy="block", metrics_port=None, transport="socket", seed=None, schedule=None):
         """Initialize the machine."""
 
         # Initialize the logical clock
@@ -42,144 +89,359 @@ class Machine(system_pb2_grpc.PeerServiceServicer):
         
         # Initialize the sockets and message queue
         self.machine_id = machine_id
-        self.peers = peers # list of peer addresses: [50051, 50052]
+        self.peers = peers # list of peer addresses: [50051, 50052] on our host, or "host:port" on others
         self.peers_id = peers_id # list of peer ids: [0, 1]
+        self.peer_weights = peer_weights # relative chance of each peer being messaged alone (default: uniform)
         self.host = host
         self.port = port
-        # Necessary to avoid Unix .qsize bug
-        m = multiprocessing.Manager()
-        self.message_queue = m.Queue()
+        self.peer_addresses = [peer_address(peer, host) for peer in peers]
+        # Listener threads and the run loop share a process, so a locked in-process inbox suffices
+        self.message_queue = Inbox(inbox_capacity, inbox_policy)
+        # With credit flow control each sender stream may have an equal share of the inbox in
+        # flight, and gets a credit back for every message of its we process (or drop)
+        self.credit = inbox_policy == "credit"
+        self.credit_share = max(1, inbox_capacity // max(1, len(peers))) if self.credit else None
         
         # Flag to indicate if the machine is running
         self.running = multiprocessing.Value('b', False)
 
         self.log_path = log_path
+        self.log_format = log_format # text (machine_<id>.log) or ndjson (machine_<id>.jsonl)
         
-        # Set up server to listen for messages
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server.bind((self.host, self.port))
-        self.server.listen()
-
-    def _start_server(self):
-        """Start the server in a separate thread"""
-        
-        # Start listener thread for incoming connections
-        listener_thread = threading.Thread(target=self._receive_messages, daemon=True)
-        listener_thread.start()
-        
-        # Give time for all machines to start up
-        time.sleep(2)
-
-        # Set the running flag
-        self.running = True
-
-        # Initialize the logger
-        log_path = self.log_path
-        if not os.path.exists(log_path):
-            os.makedirs(log_path)
-        self.logger = logging.getLogger(f"{log_path}/machine_{self.machine_id}")
-        self.logger.setLevel(logging.INFO)
-        handler = logging.FileHandler(f"{log_path}/machine_{self.machine_id}.log", mode='w')
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
-        self.logger.addHandler(handler)   
-        # Write first log message
-        self.logger.info(f"[INIT] with clock rate {self.clock_rate} and peers {self.peers}, {self.peers_id}") 
-
-
-    def run(self, p_a, p_b, p_c):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"unknown transport {transport!r}, expected one of {TRANSPORTS}")
+        self.transport = transport
+        self.server = None
+        self.grpc_server = None
+        self.shm_inbound = None
+        # gRPC streams and rings bring their own flow control, and have no way to return credits
+        if self.credit and transport != "socket":
+            raise ValueError("credit flow control needs the socket transport")
+        if transport == "shm":
+            check_platform()
+            # A ring from each peer into our inbox, and one to each peer; peers must share our host
+            if any(peer_host != host for peer_host, _ in self.peer_addresses):
+                raise ValueError("the shm transport needs every peer on this machine's host")
+            peer_ports = [port for _, port in self.peer_addresses]
+            self.shm_inbound = ShmInbound(self.port, peer_ports)
+            self.pool = ShmPeerPool(self.port, peer_ports)
+        elif transport == "grpc":
+            # One server worker per inbound stream, plus a few for unary calls
+            self.grpc_server = grpc_server(self, self.host, self.port, len(peers) + 4)
+            # Persistent streams, opened lazily on first send
+            self.pool = GrpcPeerPool(self.peer_addresses)
+        else:
+            # Set up server to listen for messages
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server.bind((self.host, self.port))
+            self.server.listen()
+
+            # Persistent outbound streams, opened lazily on first send
+            self.pool = PeerPool(self.peer_addresses, credit=self.credit)
+        # Messages produced during a tick (or flush window) are coalesced into one write per peer
+        self.batcher = SendBatcher(self.pool, flush_window)
+
+        # Next sequence number on each outbound link, and latency / loss of received messages
+        self.next_seq = [0] * len(peers)
+        self.latency = LatencyStats()
+        # Messages not sent because the peer had granted us no credit
+        self.withheld = [0] * len(peers)
+
+        # Live counters served on metrics_port (if set) while the machine runs
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.internal_events = 0
+        self.send_errors = 0
+
+        # Ticks are paced on absolute monotonic deadlines (skip or catch_up when behind)
+        self.scheduler = TickScheduler(clock_rate, tick_policy)
+
+        # How many queued messages each tick handles
+        self.process_policy = process_policy
+        self.process_limit = process_limit(process_policy, process_batch)
+
+        # Actions are drawn from our own stream, so a run is reproducible from its seeds
+        self.rng = random.Random(seed)
+        # A recorded schedule (see replay.py) to follow instead
+        self.schedule = schedule
+        self.cursor = None
+        if schedule is not None:
+            # Imported here so that machines that don't replay never load the log parser
+            from replay import ScheduleCursor
+            self.cursor = ScheduleCursor(schedule, peers_id, lambda message: message.sender_id)
+
+    def _start_server(self, start_barrier=None):
+        """Start the server in a separate thread, then wait for the rest of the cluster
+
+        Returns the monotonic instant (ns) the first tick is due, shared by every machine
+        that waits on start_barrier; None without a barrier (start right away).
+        """
+
+        try:
+            if self.grpc_server is not None:
+                self.grpc_server.start()
+            elif self.shm_inbound is not None:
+                # Move messages from the rings into the inbox as peers write them
+                threading.Thread(target=self.shm_inbound.serve, args=(self.message_queue.put_many,), daemon=True).start()
+            else:
+                # Start listener thread for incoming connections
+                listener_thread = threading.Thread(target=self._receive_messages, daemon=True)
+                listener_thread.start()
+
+            # Serve live metrics from this (the running) process
+            if self.metrics_port is not None:
+                self.metrics_server = MetricsServer(self.host, self.metrics_port, self.metrics_text)
+
+            # Set the running flag
+            self.running = True
+
+            # Initialize the logger
+            self.logger = setup_logger(self.log_path, self.machine_id, self.log_format)
+            # Write first log message
+            self.logger.info(f"[INIT] with clock rate {self.clock_rate} and peers {self.peers}, {self.peers_id}") 
+        except Exception:
+            # As in run_machine: a machine that cannot serve must not hold up the rest of the cluster
+            if start_barrier is not None:
+                start_barrier.abort()
+            raise
+
+        # Our socket has been listening since __init__; wait until every peer's is too
+        if start_barrier is None:
+            return None
+        return start_barrier.wait()
+
+    def run(self, p_a, p_b, p_c, start_barrier=None):
         """Main loop for processing messages and events
         p_a: probability threshold for sending msg to machine A
         p_b: probability threshold for sending msg to machine B
-        p_c: probability threshold for sending msg to both machines
+        p_c: probability threshold for sending msg to all peers
         above p_c: internal event
+        With more than two peers, the A and B shares are spread over all peers by peer_weights.
+        start_barrier: optional scheduler.StartBarrier shared with the other machines of the trial
         """
+        actions = ActionModel.from_thresholds(p_a, p_b, p_c, len(self.peers), self.peer_weights)
+
+        # Start the server and wait for the cluster to be ready
+        start_ns = self._start_server(start_barrier)
 
-        # Start the server and connect to peers
-        self._start_server()
+        # Exit the loop cleanly when the launcher terminates us, so stats get written
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda signum, frame: self._request_stop())
 
+        self.scheduler.start(start_ns)
         while self.running:
-            # Bookkeeping
-            start = time.time()
+            if self.schedule is not None:
+                self._replay_tick()
+            else:
+                # Check for incoming messages (and the queue length left behind)
+                messages, queue_length = self.message_queue.pop_many(self.process_limit)
+                if messages:
+                    self._apply_messages(messages, queue_length)
+                    if self.credit:
+                        self._return_credits(messages)
+                # Generate random action
+                else:
+                    targets = actions.choose(self.rng)
+                    if targets:
+                        for i in targets:
+                            self._send_message(i)
+                        self.logical_clock += 1
+                    # Trigger an internal event
+                    else:
+                        self._internal_event()
 
-            # Check for incoming messages
-            if not self.message_queue.empty():
-                message = self.message_queue.get() 
+            # Write out this tick's messages once the flush window has elapsed
+            if self.batcher.due():
+                self._flush_sends()
 
-                # Update clock according to Lamport
-                self.logical_clock = max(self.logical_clock, message.logical_clock) + 1
+            # Sleep until the next tick's deadline
+            if self.running:
+                self.scheduler.wait()
 
-                # Get queue length
-                queue_length = self.message_queue.qsize()
+        # Deliver anything still buffered (ending gRPC streams cleanly) and report run statistics
+        self._flush_sends()
+        self.pool.close()
+        if self.shm_inbound is not None:
+            self.shm_inbound.close()
+        self._write_stats()
 
-                # Log the message
-                self.logger.info(f"[RECEIVED] from Machine {message.sender_id}, Logical clock: {self.logical_clock}, Queue length: {queue_length}")
-            # Generate random action
-            else:
-                # TODO: modify for >3 peers
-                action = random.randint(1, 10)
-                if action < p_a:
-                    self._send_message(0)
-                    self.logical_clock += 1
-                elif action < p_b:
-                    self._send_message(1)
-                    self.logical_clock += 1
-                elif action < p_c: 
-                    for i in range(len(self.peers)):
-                        self._send_message(i)
-                    self.logical_clock += 1
-                # Trigger an internal event
-                else:
-                    self.logical_clock += 1
-                    self.logger.info(f"[INTERNAL], Logical clock: {self.logical_clock}")
+    def _internal_event(self):
+        self.logical_clock += 1
+        self.internal_events += 1
+        self.logger.event("INTERNAL", self.logical_clock)
+
+    def _apply_messages(self, messages, queue_length, drain=None):
+        """Apply a tick's messages to the logical clock and log each one (drain: with a single update; default per policy)"""
+        if drain is None:
+            drain = self.process_policy == "drain"
+        apply_received(self, messages, queue_length, drain)
+
+    def _replay_tick(self):
+        """Take the next step of the recorded schedule; a receive step waits (the tick does nothing) until its messages arrive"""
+        step = self.cursor.next_step(self.message_queue.drain())
+        if step is None:
+            return
+        kind, items = step[:2]
+        if kind == "send":
+            for target in items:
+                self._send_message(target)
+            self.logical_clock += 1
+        elif kind == "internal":
+            self._internal_event()
+        else:
+            self._apply_messages(items, step[2], drain=kind == "drain")
+            if self.credit:
+                self._return_credits(items)
+
+    def _return_credits(self, messages):
+        """Grant each stream one credit per message of its we took from (or dropped at) the inbox"""
+        counts = {}
+        for message in messages:
+            counts[message.credit_link] = counts.get(message.credit_link, 0) + 1
+        for link, n in counts.items():
+            try:
+                link.grant(n)
+            except Exception as e:
+                self.logger.error(f"Error returning credits to peer stream {link.sock}: {e}")
+
+    def _request_stop(self):
+        """Ask the run loop to exit after the current tick"""
+        self.running = False
+
+    def _flush_sends(self):
+        """Write buffered messages, one write per peer"""
+        for target, e in self.batcher.flush():
+            self.send_errors += 1
+            self.logger.error(f"Error sending message to port {target}: {e}")
+
+    def metrics(self):
+        """Current values of the live metrics (see metrics.METRICS)"""
+        inbox = self.message_queue
+        return {"logical_clock": self.logical_clock, "queue_length": len(inbox), "clock_rate": self.clock_rate,
+                "ticks_total": self.scheduler.ticks, "tick_overruns_total": self.scheduler.overruns,
+                "messages_sent_total": sum(self.next_seq), "messages_received_total": sum(self.latency.received.values()),
+                "internal_events_total": self.internal_events, "send_errors_total": self.send_errors,
+                "inbox_dropped_total": inbox.dropped_oldest + inbox.dropped_newest}
+
+    def metrics_text(self):
+        return render_metrics(self.machine_id, self.metrics())
+
+    def stats(self):
+        """Collect run statistics for this machine"""
+        return {"machine_id": self.machine_id, "batching": self.batcher.summary(), "logging": self.logger.summary(),
+                "latency": self.latency.summary(), "scheduling": self.scheduler.summary(),
+                "inbox": self.message_queue.summary(),
+                "sent": {str(self.peers_id[i]): n for i, n in enumerate(self.next_seq)},
+                "withheld": {str(self.peers_id[i]): n for i, n in enumerate(self.withheld)}}
 
-            # Bookkeeping
-            end = time.time()
-            time.sleep(max(0,self.cycle_time - (end - start)))
+    def _write_stats(self):
+        """Log and save run statistics to the log folder, then close the log"""
+        batching = self.batcher.summary()
+        self.logger.info(f"[STATS] batches: {batching['batches']}, mean batch size: {batching['mean_batch_size']:.2f}, "
+                         f"max batch size: {batching['max_batch_size']}, mean flush latency: {batching['mean_flush_latency'] * 1000:.3f} ms")
+        latency = self.latency.summary()
+        self.logger.info(f"[STATS] end-to-end latency p50: {latency['end_to_end']['p50_ms']:.3f} ms, "
+                         f"p99: {latency['end_to_end']['p99_ms']:.3f} ms, max: {latency['end_to_end']['max_ms']:.3f} ms, "
+                         f"lost: {latency['lost']}, reordered: {latency['reordered']}")
+        scheduling = self.scheduler.summary()
+        self.logger.info(f"[STATS] ticks: {scheduling['ticks']}, achieved rate: {scheduling['achieved_rate']:.3f}/s "
+                         f"(target {self.clock_rate}), overruns: {scheduling['overruns']}, skipped: {scheduling['skipped']}, "
+                         f"tick lateness p99: {scheduling['lateness']['p99_ms']:.3f} ms")
+        inbox = self.message_queue.summary()
+        self.logger.info(f"[STATS] inbox capacity: {inbox['capacity']} ({inbox['policy']}), high water: {inbox['high_water']}, "
+                         f"dropped oldest: {inbox['dropped_oldest']}, dropped newest: {inbox['dropped_newest']}, "
+                         f"blocked: {inbox['blocked_ms']:.3f} ms, withheld for credit: {sum(self.withheld)}")
+
+        # Close first so the logging statistics include the final write
+        self.logger.close()
+        with open(f"{self.log_path}/machine_{self.machine_id}_stats.json", "w") as f:
+            json.dump(self.stats(), f, indent=2)
             
     def _receive_messages(self):
-        """Listen for incoming connections from other machines"""
+        """Listen for incoming streams from other machines"""
         while self.running:
             try:
                 peer, _ = self.server.accept()
+                # Each peer keeps its stream open, so one reader thread per peer suffices
                 listening_thread = threading.Thread(target=self._service_socket, args=(peer,), daemon=True)
                 listening_thread.start()
             except Exception as e:
-                self.logger.error(f"Error accepting connection from peer {peer}: {e}")
+                self.logger.error(f"Error accepting connection from peer: {e}")
 
     def _service_socket(self, peer):
-            """Handle messages coming an existing connection"""
+            """Read framed messages from a peer stream until it closes"""
+            decoder = FrameDecoder()
+            # Credits are per stream: a sender that reconnects gets a fresh share on its new one
+            link = CreditLink(peer) if self.credit else None
             try:
-                data = peer.recv(1024)
-            
-                # Deserialize the message and put on queue
-                msg = Message.from_json(data.decode())
-                self.message_queue.put(msg)
+                # Grant the sender its share of the inbox up front
+                if link is not None:
+                    link.grant(self.credit_share)
+                while True:
+                    data = peer.recv(65536)
+                    if not data:
+                        break
+
+                    # A read may hold a partial frame or several frames; queue every complete message
+                    messages = decoder.messages(data)
+                    enqueue_ns = time.monotonic_ns()
+                    for message in messages:
+                        message.enqueue_ns = enqueue_ns
+                    if link is not None:
+                        # Tag each message with the stream its credit goes back on
+                        for message in messages:
+                            message.credit_link = link
+                    dropped = self.message_queue.put_many(messages)
+                    # Messages the inbox had no room for free up their credits too
+                    if link is not None and dropped:
+                        self._return_credits(dropped)
             except Exception as e:
                 self.logger.error(f"Error servicing connection from peer {peer}: {e}")
             finally:
+                if link is not None:
+                    link.close()
                 peer.close()
 
+    def StreamMessages(self, request_iterator, context):
+        """gRPC transport: queue every message batch a peer streams to us until it ends the stream"""
+        for batch in request_iterator:
+            messages = decode_batch(batch)
+            enqueue_ns = time.monotonic_ns()
+            for message in messages:
+                message.enqueue_ns = enqueue_ns
+            self.message_queue.put_many(messages)
+        return empty_pb2.Empty()
+
     def _send_message(self, target):
-        """Send a message to peer"""
+        """Queue a message to peer for the next flush"""
+        # Without credit from the peer the message is not sent at all
+        if not self.pool.take_credit(target):
+            self.withheld[target] += 1
+            return
 
-        peer = None
         try:
-            # Create message
-            msg = Message(self.machine_id, self.logical_clock)
-            peer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            peer.connect((self.host, self.peers[target]))
-            peer.sendall(msg.to_json().encode())
+            # Create message and buffer it for the peer's persistent stream
+            msg = Message(self.machine_id, self.logical_clock, time.monotonic_ns(), self.next_seq[target])
+            self.next_seq[target] += 1
+            self.batcher.add(target, self.pool.encode(msg))
         except Exception as e:
+            self.send_errors += 1
             self.logger.error(f"Error sending message to port {target}: {e}")
         finally:
-            self.logger.info(f"[SENT] to Machine {self.peers_id[target]}, Logical clock: {self.logical_clock}")
-
-            if peer:
-                peer.close()
+            self.logger.event("SENT", self.logical_clock, peer=self.peers_id[target])
 
         
     def stop(self):
         """Signal stop, close channels, and end run loop."""
         self.running = False
-        self.server.close()
\ No newline at end of file
+        self.message_queue.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        self.pool.close()
+        if self.server is not None:
+            self.server.close()
+        if self.grpc_server is not None:
+            self.grpc_server.stop(grace=None)
+        if self.shm_inbound is not None:
+            self.shm_inbound.close()
\ No newline at end of file
@@ -1,7 +1,16 @@
+import asyncio
 import multiprocessing
 import time
 import random
-from machine import Machine
+from machine import DEFAULT_PROCESS_BATCH, run_machine
+from async_machine import AsyncMachine, run_cluster
+from topology import build_topology
+from event_store import compact_run
+from event_log import create_run_folder, write_run_anchor
+from metrics import MetricsAggregator
+from scheduler import StartBarrier, run_trials, trial_parallelism
+from cluster import ClusterSpec, Coordinator
+from replay import RecordedRun, compare_traces, derive_seed, new_seed, report
 import yaml
 import threading
 import os
@@ -18,51 +27,193 @@ with open("experiment_config.yaml", "r") as f:
     CYCLE_MAX = config["CYCLE_MAX"]
     BASE_PORT = config["BASE_PORT"]
     HOST = config.get("HOST", "localhost")
+    FLUSH_WINDOW = config.get("FLUSH_WINDOW", 0.0)
+    RUNTIME = config.get("RUNTIME", "thread")
+    TOPOLOGY = config.get("TOPOLOGY", "full_mesh")
+    TOPOLOGY_DEGREE = config.get("TOPOLOGY_DEGREE")
+    PEER_WEIGHTS = config.get("PEER_WEIGHTS")
+    LOG_FORMAT = config.get("LOG_FORMAT", "text")
+    COMPACT_EVENTS = config.get("COMPACT_EVENTS", False)
+    TICK_POLICY = config.get("TICK_POLICY", "skip")
+    PROCESS_POLICY = config.get("PROCESS_POLICY", "one")
+    PROCESS_BATCH = config.get("PROCESS_BATCH", DEFAULT_PROCESS_BATCH)
+    INBOX_CAPACITY = config.get("INBOX_CAPACITY")
+    INBOX_POLICY = config.get("INBOX_POLICY", "block")
+    METRICS_BASE_PORT = config.get("METRICS_BASE_PORT")
+    METRICS_INTERVAL = config.get("METRICS_INTERVAL", 1.0)
+    METRICS_MAX_QUEUE = config.get("METRICS_MAX_QUEUE")
+    TRANSPORT = config.get("TRANSPORT", "socket")
+    CLUSTER_SPEC = config.get("CLUSTER_SPEC")
+    SEED = config.get("SEED")
+    REPLAY = config.get("REPLAY")
+    PARALLEL_TRIALS = config.get("PARALLEL_TRIALS", 1)
 
-if __name__ == "__main__":
-    # Run the experiment N_TRIALS
-    for _ in range(N_TRIALS):
-        # Create a unique logging folder for each run
-        log_folder = f"logs/run_prob_{int(time.time())}"
-        os.makedirs(log_folder, exist_ok=True)
-        # Save config to folder
-        with open(f"{log_folder}/config.yaml", "w") as f:
-            yaml.dump(config, f)
-
-        ports = [f"localhost:{BASE_PORT + i}" for i in range(N_MACHINES)]
-        machines = []
-
-        # Create N_MACHINES machines
-        for i in range(N_MACHINES):
-            my_port = BASE_PORT + i
-            clock_rate = random.randint(1, CYCLE_MAX)  # random clock ticks / second
-            peers = []      # list of peer addresses
-            peers_id = []   # list of peer ids
-            # Make sure each machine is not listed as its own peer
-            for j in range(N_MACHINES):
-                if j != i:
-                    peers.append(BASE_PORT + j)
-                    peers_id.append(j)
-            # Create machine
-            m = Machine(i, HOST, my_port, clock_rate, peers, peers_id, log_path=log_folder)
-            machines.append(m)
-
-        # Start all machines on separate threads
+def run_trial(trial, slot=0):
+    """Run one trial, on the slot'th port range when trials run in parallel"""
+    # Create a unique logging folder for each run
+    log_folder = create_run_folder(f"run_prob_{int(time.time())}_{trial}")
+    # Save config to folder (SEED and TRIAL reproduce the trial's random choices)
+    with open(f"{log_folder}/config.yaml", "w") as f:
+        yaml.dump({**config, "TRIAL": trial}, f)
+    # Maps the machines' monotonic log timestamps back to the wall clock
+    # (nodes add an anchor per machine, as their monotonic clocks differ from ours)
+    write_run_anchor(log_folder)
+    if coordinator is not None:
+        spec.save(f"{log_folder}/cluster.yaml")
+
+    # Concurrent trials each listen on a port range of their own
+    trial_spec = spec if coordinator is not None else ClusterSpec.single_host(N_MACHINES, HOST, BASE_PORT + slot * N_MACHINES)
+    metrics_base_port = METRICS_BASE_PORT + slot * N_MACHINES if METRICS_BASE_PORT is not None else None
+
+    machines = []
+    # Separate random streams for the clock rates, the topology and each machine's actions
+    trial_seed = derive_seed(SEED, "trial", trial)
+    rng = random.Random(derive_seed(trial_seed, "clock_rates"))
+    # Peer ids of each machine (never including itself)
+    topology = build_topology(TOPOLOGY, N_MACHINES, degree=TOPOLOGY_DEGREE, seed=derive_seed(trial_seed, "topology"))
+    if replay is not None:
+        topology = [replay.topology[i] for i in range(N_MACHINES)]
+
+    # Create N_MACHINES machines
+    for i in range(N_MACHINES):
+        my_host, my_port = trial_spec.machines[i]
+        clock_rate = rng.randint(1, CYCLE_MAX)  # random clock ticks / second
+        if replay is not None:
+            clock_rate = replay.clock_rates[i]
+        seed = derive_seed(trial_seed, "machine", i)
+        schedule = replay.schedules[i] if replay is not None else None
+        peers_id = topology[i]   # list of peer ids
+        peers = [trial_spec.peer(i, j) for j in peers_id]      # list of peer addresses
+        # Optional per-machine weights for being picked as a single message's target
+        peer_weights = [PEER_WEIGHTS[j] for j in peers_id] if PEER_WEIGHTS else None
+        # Live metrics endpoint, if enabled
+        metrics_port = metrics_base_port + i if metrics_base_port is not None else None
+        # Create machine
+        if RUNTIME == "asyncio":
+            m = AsyncMachine(i, my_host, my_port, clock_rate, peers, peers_id, log_path=log_folder, peer_weights=peer_weights, log_format=LOG_FORMAT, tick_policy=TICK_POLICY, process_policy=PROCESS_POLICY, process_batch=PROCESS_BATCH, metrics_port=metrics_port, seed=seed)
+        else:
+            # Each process builds its own Machine, so machines start up in parallel
+            m = dict(machine_id=i, host=my_host, port=my_port, clock_rate=clock_rate, peers=peers, peers_id=peers_id, log_path=log_folder, flush_window=FLUSH_WINDOW, peer_weights=peer_weights, log_format=LOG_FORMAT, tick_policy=TICK_POLICY, process_policy=PROCESS_POLICY, process_batch=PROCESS_BATCH, inbox_capacity=INBOX_CAPACITY, inbox_policy=INBOX_POLICY, metrics_port=metrics_port, transport=TRANSPORT, seed=seed, schedule=schedule)
+        machines.append(m)
+
+    # Sample every machine's live metrics while the run is in progress
+    aggregator = None
+    if metrics_base_port is not None:
+        addresses = {i: (trial_spec.machines[i][0], metrics_base_port + i) for i in range(N_MACHINES)}
+        aggregator = MetricsAggregator(addresses, METRICS_INTERVAL, METRICS_MAX_QUEUE, out_file=f"{log_folder}/live_metrics.jsonl")
+
+    # The asyncio runtime runs every machine on one event loop in this process
+    if RUNTIME == "asyncio":
+        abort = threading.Event()
+        if aggregator is not None:
+            threading.Thread(target=aggregator.run, args=(DURATION, abort), daemon=True).start()
+        startup = asyncio.run(run_cluster(machines, PROB_MSG_A, PROB_MSG_B, PROB_MSG_C, DURATION, abort))
+        abort.set()
+        print(f"Trial {trial}: {N_MACHINES} machines started in {startup * 1000:.1f} ms")
+    else:
         threads = []
-        for m in machines:
-            t = multiprocessing.Process(target=m.run, args=(PROB_MSG_A,PROB_MSG_B,PROB_MSG_C),daemon=True)
-            t.start()
-            threads.append(t)
-        
-        # Allow threads to run for RUN_DURATION seconds
-        time.sleep(DURATION)
-
-        # Stop all machines
+        failure = None
+        try:
+            if coordinator is not None:
+                # Every node launches its machines; returns at their common first tick
+                launch_ns = time.time_ns()
+                start_ns = coordinator.start_trial(os.path.basename(log_folder), machines, (PROB_MSG_A, PROB_MSG_B, PROB_MSG_C))
+                print(f"Trial {trial}: {N_MACHINES} machines on {len(coordinator.nodes)} nodes started in {(start_ns - launch_ns) / 1e6:.1f} ms")
+            else:
+                # Start all machines on separate processes; we are the barrier's last party
+                launch_ns = time.monotonic_ns()
+                start_barrier = StartBarrier(N_MACHINES + 1)
+                for m in machines:
+                    t = multiprocessing.Process(target=run_machine, args=(m, PROB_MSG_A, PROB_MSG_B, PROB_MSG_C, start_barrier), daemon=True)
+                    t.start()
+                    threads.append(t)
+
+                # Returns once every machine is listening, at their common first tick
+                start_ns = start_barrier.wait()
+                print(f"Trial {trial}: {N_MACHINES} machines started in {(start_ns - launch_ns) / 1e6:.1f} ms")
+
+            # Allow threads to run for RUN_DURATION seconds, or until the aggregator aborts the run
+            if aggregator is not None:
+                aggregator.run(DURATION)
+            else:
+                time.sleep(DURATION)
+        except threading.BrokenBarrierError:
+            failure = f"Trial {trial}: a machine failed to start"
+            print(f"{failure}, ending the trial")
+
+        # Stop every node's machines together and gather their logs into log_folder
+        if coordinator is not None:
+            coordinator.stop_trial(log_folder)
+
+        # Stop all machines (SIGTERM lets each run loop flush and write its stats)
         for t in threads:
             t.terminate()
 
         # Wait for them to shut down
         for t in threads:
             t.join()
+        # The logs are collected; now fail the trial, so the sweep reports it
+        if failure is not None:
+            raise RuntimeError(failure)
+
+    if aggregator is not None and aggregator.abort_reason:
+        print(f"Run aborted early: {aggregator.abort_reason}")
+
+    # Check the replay followed the recorded logical clocks
+    if replay is not None:
+        report(compare_traces(replay.traces, RecordedRun(log_folder, check=False).traces))
+
+    # Compact the machine logs into one typed columnar file for analysis.py
+    if COMPACT_EVENTS:
+        compact_run(log_folder)
+    print(f"Trial {trial}: logs in {log_folder}")
+
+if __name__ == "__main__":
+    # A replay reruns a recorded run's workload (machines, clock rates, topology and every tick) with this config's runtime settings
+    replay = None
+    if REPLAY is not None:
+        if RUNTIME == "asyncio":
+            raise ValueError("replays need the thread runtime")
+        replay = RecordedRun(REPLAY)
+        N_MACHINES = config["N_MACHINES"] = len(replay.schedules)
+
+    # Every random choice derives from the master seed, recorded in each run's config.yaml
+    if SEED is None:
+        SEED = config["SEED"] = new_seed()
+
+    # Trials at once: a thread-runtime trial is a process per machine, an asyncio one a single process
+    parallel = trial_parallelism(PARALLEL_TRIALS, N_TRIALS, 1 if RUNTIME == "asyncio" else N_MACHINES)
+
+    # Where every machine listens: all on HOST, or spread over several nodes by a cluster spec
+    coordinator = None
+    if CLUSTER_SPEC is not None:
+        spec = ClusterSpec.load(CLUSTER_SPEC)
+        if sorted(spec.machines) != list(range(N_MACHINES)):
+            raise ValueError(f"{CLUSTER_SPEC} must place exactly machines 0 to {N_MACHINES - 1}")
+        if RUNTIME == "asyncio":
+            raise ValueError("the asyncio runtime runs every machine in this process, so it cannot use CLUSTER_SPEC")
+        # A launcher on each node (python cluster.py CLUSTER_SPEC ...) runs its machines for us
+        coordinator = Coordinator(spec)
+        coordinator.wait_for_nodes()
+        # The spec gives each machine one address, so trials take turns
+        parallel = 1
+    else:
+        spec = ClusterSpec.single_host(N_MACHINES, HOST, BASE_PORT)
+
+    # Concurrent trials' port ranges (machines, then metrics endpoints) must not overlap
+    ports = [BASE_PORT + k for k in range(parallel * N_MACHINES)]
+    if METRICS_BASE_PORT is not None:
+        ports += [METRICS_BASE_PORT + k for k in range(parallel * N_MACHINES)]
+    if len(set(ports)) < len(ports):
+        raise ValueError(f"{parallel} concurrent trials of {N_MACHINES} machines need ports {BASE_PORT}-{BASE_PORT + parallel * N_MACHINES - 1}, "
+                         f"which overlap the metrics ports from METRICS_BASE_PORT")
+
+    # Run the experiment N_TRIALS, parallel at a time
+    sweep_start = time.perf_counter()
+    failed = run_trials(run_trial, N_TRIALS, parallel)
+    for trial in failed:
+        print(f"Trial {trial} failed")
 
-    print("All machines have stopped.")
\ No newline at end of file
+    if coordinator is not None:
+        coordinator.close()
+    print(f"All machines have stopped. {N_TRIALS} trials ({parallel} at a time) took {time.perf_counter() - sweep_start:.1f}s")
\ No newline at end of file
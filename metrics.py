@@ -0,0 +1,155 @@
+import json
+import re
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Live metrics of a machine: (name, Prometheus type, help text)
+METRICS = (
+    ("logical_clock", "gauge", "Current Lamport clock"),
+    ("queue_length", "gauge", "Messages waiting in the inbox"),
+    ("clock_rate", "gauge", "Target ticks per second"),
+    ("ticks_total", "counter", "Ticks run"),
+    ("tick_overruns_total", "counter", "Ticks that started after their deadline"),
+    ("messages_sent_total", "counter", "Messages sent to peers"),
+    ("messages_received_total", "counter", "Messages taken from the inbox and applied"),
+    ("internal_events_total", "counter", "Internal events"),
+    ("send_errors_total", "counter", "Failed message sends"),
+    ("inbox_dropped_total", "counter", "Messages dropped by a full inbox"),
+)
+
+# Every metric name is prefixed, so they sort together next to other exporters' metrics
+PREFIX = "lamport_"
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+SAMPLE_PATTERN = re.compile(r'^' + PREFIX + r'(\w+)\{machine="(\d+)"\} (\S+)$')
+
+def render_metrics(machine_id, values: dict) -> str:
+    """Prometheus text exposition of one machine's metric values."""
+    lines = []
+    for name, kind, help_text in METRICS:
+        if name in values:
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            lines.append(f'{PREFIX}{name}{{machine="{machine_id}"}} {values[name]}')
+    return "\n".join(lines) + "\n"
+
+def parse_metrics(text: str) -> dict:
+    """{machine id: {name: value}} from Prometheus text written by render_metrics."""
+    machines = {}
+    for line in text.splitlines():
+        match = SAMPLE_PATTERN.match(line)
+        if match:
+            name, machine_id, value = match.groups()
+            machines.setdefault(int(machine_id), {})[name] = float(value)
+    return machines
+
+def _handler(collect):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = collect().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes every second would otherwise flood stderr
+            pass
+    return MetricsHandler
+
+class MetricsServer:
+    """Serves GET /metrics from a daemon thread; collect() returns the exposition text."""
+    def __init__(self, host: str, port: int, collect):
+        self.httpd = ThreadingHTTPServer((host, port), _handler(collect))
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def scrape(host: str, port: int, timeout=1.0) -> dict:
+    """Fetch and parse one machine's metrics endpoint."""
+    with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=timeout) as response:
+        return parse_metrics(response.read().decode())
+
+class MetricsAggregator:
+    """Samples every machine's endpoint at a fixed interval while a run is in progress.
+
+    Each sample gets per-machine send / receive / internal rates (from the change in the
+    counters since the previous sample) and cluster-wide drift, the spread between the
+    largest and smallest logical clock. Samples are appended to out_file as JSON lines and
+    summarised on stdout. With max_queue set, the run is aborted once any inbox grows past it.
+    """
+    RATES = ("messages_sent_total", "messages_received_total", "internal_events_total")
+
+    def __init__(self, addresses: dict, interval=1.0, max_queue=None, out_file=None):
+        # addresses: {machine id: (host, metrics port)}
+        self.addresses = addresses
+        self.interval = interval
+        self.max_queue = max_queue
+        self.out_file = out_file
+        self.previous = {}
+        self.samples = 0
+        self.abort_reason = None
+
+    def sample(self):
+        """Scrape every machine once and return the sample (machines that did not answer are left out)."""
+        now = time.monotonic()
+        machines = {}
+        for machine_id, (host, port) in self.addresses.items():
+            try:
+                values = scrape(host, port).get(machine_id)
+            except OSError:
+                continue
+            if values is None:
+                continue
+            previous = self.previous.get(machine_id)
+            if previous is not None:
+                elapsed = now - previous[0]
+                for name in self.RATES:
+                    values[name.replace("_total", "_per_s")] = (values[name] - previous[1][name]) / elapsed
+            self.previous[machine_id] = (now, values)
+            machines[machine_id] = values
+
+        clocks = [v["logical_clock"] for v in machines.values()]
+        queues = [v["queue_length"] for v in machines.values()]
+        self.samples += 1
+        return {
+            "time": time.time(),
+            "drift": max(clocks) - min(clocks) if clocks else 0,
+            "max_queue_length": max(queues) if queues else 0,
+            "machines": {str(i): v for i, v in sorted(machines.items())},
+        }
+
+    def run(self, duration, stop=None):
+        """Sample until duration has passed or stop is set; returns why the run should end early, or None."""
+        stop = stop or threading.Event()
+        deadline = time.monotonic() + duration
+        out = open(self.out_file, "a") if self.out_file else None
+        try:
+            while not stop.wait(min(self.interval, max(0.0, deadline - time.monotonic()))):
+                if time.monotonic() >= deadline:
+                    return None
+                sample = self.sample()
+                if out is not None:
+                    out.write(json.dumps(sample) + "\n")
+                    out.flush()
+                print(f"[METRICS] {len(sample['machines'])}/{len(self.addresses)} machines, "
+                      f"drift: {sample['drift']:.0f}, max queue length: {sample['max_queue_length']:.0f}")
+                if self.max_queue is not None and sample["max_queue_length"] > self.max_queue:
+                    self.abort_reason = f"queue length {sample['max_queue_length']:.0f} over {self.max_queue}"
+                    stop.set()
+                    return self.abort_reason
+            return None
+        finally:
+            if out is not None:
+                out.close()
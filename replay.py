@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+from collections import Counter, deque
+import yaml
+from log_parser import EVENT_OPS, find_machine_logs
+
+# A run's recorded schedule has one step per tick of each machine:
+#   ("send", [peer ids])        sent a message to each peer, then advanced its clock
+#   ("internal", [])            an internal event
+#   ("receive", [sender ids])   applied the next message from each sender, one Lamport update per message
+#   ("drain", [sender ids])     applied them with a single Lamport update (PROCESS_POLICY: drain)
+# except under PROCESS_POLICY: batch, whose ticks log each message at its own clock, just like
+# consecutive one-message ticks; each becomes a receive step of its own, so a replay reproduces
+# the clock trace but spreads a batch over as many ticks as it had messages.
+STEP_KINDS = ("send", "internal", "receive", "drain")
+
+# Event lines of a text machine log: operation, peer (SENT / RECEIVED) and logical clock
+TEXT_EVENT_PATTERN = re.compile(r"\[(SENT|RECEIVED|INTERNAL)\](?: (?:to|from) Machine (\d+))?, Logical clock: (\d+)")
+# The [INIT] line: clock rate, and the peer ids it ends with
+INIT_PATTERN = re.compile(r"\[INIT\] with clock rate (\d+) and peers .*, (\[[\d, ]*\])\s*$")
+
+def new_seed():
+    """A fresh master seed, for runs that don't set SEED."""
+    return random.SystemRandom().getrandbits(63)
+
+def derive_seed(seed, *stream) -> int:
+    """64-bit seed of a named stream of a master seed, e.g. derive_seed(seed, "machine", 3).
+
+    Streams are independent of each other, and of how many other streams are drawn.
+    """
+    key = "/".join(str(part) for part in (seed, *stream))
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+
+def read_machine_log(path):
+    """(clock rate, peer ids, [(operation, peer, logical clock)]) from a text or ndjson machine log."""
+    init = None
+    events = []
+    with open(path, "r") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                record = json.loads(line)
+                if record["op"] in EVENT_OPS:
+                    events.append((record["op"], record["peer"], record["logical_clock"]))
+                elif init is None and record["op"] == "LOG":
+                    init = INIT_PATTERN.search(record["msg"])
+        else:
+            for line in f:
+                match = TEXT_EVENT_PATTERN.search(line)
+                if match:
+                    op, peer, clock = match.groups()
+                    events.append((op, None if peer is None else int(peer), int(clock)))
+                elif init is None:
+                    init = INIT_PATTERN.search(line)
+    if init is None:
+        raise ValueError(f"{path} has no [INIT] line")
+    return int(init.group(1)), json.loads(init.group(2)), events
+
+def build_schedule(events) -> list:
+    """Schedule steps of a machine from its logged events.
+
+    A tick's sends are all logged at the clock before it advances, and the messages of a
+    drained tick all at the clock after the single update; no two ticks share a clock.
+    A batch tick's messages are logged at successive clocks and can't be told apart from
+    one-message ticks, so they become one receive step per message.
+    """
+    steps = []
+    last_op = last_clock = None
+    for op, peer, clock in events:
+        if op == "INTERNAL":
+            steps.append(("internal", []))
+        elif op == last_op and clock == last_clock:
+            if op == "RECEIVED":
+                steps[-1] = ("drain", steps[-1][1])
+            steps[-1][1].append(peer)
+        else:
+            steps.append(("send" if op == "SENT" else "receive", [peer]))
+        last_op, last_clock = op, clock
+    return steps
+
+def check_replayable(log_folder, machine_id):
+    """Raise ValueError if the machine's stats show its log does not account for every message."""
+    path = os.path.join(log_folder, f"machine_{machine_id}_stats.json")
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as f:
+        stats = json.load(f)
+    problems = []
+    if stats.get("logging", {}).get("dropped"):
+        problems.append("log events were dropped")
+    inbox = stats.get("inbox", {})
+    if inbox.get("dropped_oldest") or inbox.get("dropped_newest"):
+        problems.append("its inbox dropped messages")
+    if stats.get("latency", {}).get("lost"):
+        problems.append("messages to it were lost")
+    if any(stats.get("withheld", {}).values()):
+        problems.append("sends were withheld for credit")
+    if problems:
+        raise ValueError(f"machine {machine_id} of {log_folder} cannot be replayed: {', '.join(problems)}")
+
+class ScheduleCursor:
+    """Position in one machine's recorded schedule; Machine and Simulation both replay through it.
+
+    Each tick, next_step() is handed the messages that reached the inbox since the last
+    tick and returns the step to carry out:
+        ("send", [peer indexes])                    send to each, then advance the clock
+        ("internal", [])                            an internal event
+        ("receive" / "drain", [messages], waiting)  apply these messages, in order; waiting
+                                                    are still set aside for later steps
+    or None once the schedule is done, or while a receive step still waits for its messages.
+    """
+    def __init__(self, schedule, peers_id, sender_of):
+        self.schedule = schedule
+        self.step = 0
+        self.peer_index = {peer: i for i, peer in enumerate(peers_id)}
+        # sender id of a message, however the runtime represents it
+        self.sender_of = sender_of
+        # Messages from each sender waiting for their step
+        self.pending = {}
+
+    def done(self):
+        return self.step == len(self.schedule)
+
+    def next_step(self, arrived):
+        pending = self.pending
+        for message in arrived:
+            pending.setdefault(self.sender_of(message), deque()).append(message)
+        if self.done():
+            return None
+        kind, peers = self.schedule[self.step]
+        if kind == "send":
+            step = (kind, [self.peer_index[peer] for peer in peers])
+        elif kind == "internal":
+            step = (kind, [])
+        else:
+            # Links are FIFO, so the step's messages are the oldest waiting from each sender
+            if any(len(pending.get(s, ())) < n for s, n in Counter(peers).items()):
+                return None
+            messages = [pending[s].popleft() for s in peers]
+            step = (kind, messages, sum(map(len, pending.values())))
+        self.step += 1
+        return step
+
+class RecordedRun:
+    """A run's workload as recorded in its folder: config, clock rates, topology, and per-machine schedules and clock traces."""
+    def __init__(self, log_folder, check=True):
+        self.log_folder = log_folder
+        with open(os.path.join(log_folder, "config.yaml"), "r") as f:
+            self.config = yaml.safe_load(f)
+        self.clock_rates = {}
+        self.topology = {}
+        self.schedules = {}
+        self.traces = {}
+        for i, file_name in find_machine_logs(log_folder).items():
+            if check:
+                check_replayable(log_folder, i)
+            clock_rate, peers_id, events = read_machine_log(os.path.join(log_folder, file_name))
+            self.clock_rates[i] = clock_rate
+            self.topology[i] = peers_id
+            self.schedules[i] = build_schedule(events)
+            self.traces[i] = [(op, clock) for op, _, clock in events]
+
+def replay_simulated(run: RecordedRun, network_delay=0.001, max_duration=None):
+    """Re-execute a recorded run's schedules in the simulator; returns {machine id: replayed trace}."""
+    # Imported here: the simulator imports this module to replay schedules
+    from simulation import Simulation
+    ids = sorted(run.schedules)
+    sim = Simulation([run.clock_rates[i] for i in ids], 0, 0, 0, network_delay=network_delay,
+                     topology=[run.topology[i] for i in ids], schedules=[run.schedules[i] for i in ids])
+    # Waiting for a message that never comes would stall forever; stop well after the recorded duration
+    sim.run(max_duration if max_duration is not None else 10 * run.config.get("DURATION", 60) + 10)
+    return {i: m.trace for i, m in zip(ids, sim.machines)}
+
+def compare_traces(recorded: dict, replayed: dict) -> dict:
+    """{machine id: (events matched, events recorded, index of the first differing event or None)}."""
+    results = {}
+    for i, trace in recorded.items():
+        other = replayed.get(i, [])
+        matched = 0
+        while matched < min(len(trace), len(other)) and trace[matched] == other[matched]:
+            matched += 1
+        diverged = matched if matched < len(other) else None
+        results[i] = (matched, len(trace), diverged)
+    return results
+
+def report(results: dict):
+    """Print a comparison from compare_traces; returns whether every trace was reproduced in full."""
+    identical = True
+    for i, (matched, total, diverged) in sorted(results.items()):
+        if diverged is not None:
+            status = f"diverges at event {diverged}"
+        elif matched < total:
+            status = "unfinished"
+        else:
+            status = "identical"
+        identical = identical and status == "identical"
+        print(f"[REPLAY] machine {i}: {matched:,}/{total:,} events {status}")
+    return identical
+
+if __name__ == "__main__":
+    # python replay.py RUN_FOLDER: replay a run in the simulator and check its logical-clock traces are reproduced
+    if len(sys.argv) < 2:
+        print("Usage: python replay.py RUN_FOLDER")
+        sys.exit(1)
+    run = RecordedRun(sys.argv[1])
+    identical = report(compare_traces(run.traces, replay_simulated(run)))
+    sys.exit(0 if identical else 1)
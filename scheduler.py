@@ -0,0 +1,192 @@
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import time
+import traceback
+from latency import LatencyHistogram
+
+# What to do when ticks fall behind schedule
+TICK_POLICIES = ("skip", "catch_up")
+
+# Time between the last party reaching the start barrier and the common first tick,
+# so every process has woken up before it is due
+START_LEAD_NS = 5_000_000
+
+# How long to wait for every machine to be ready before giving up on the trial
+START_TIMEOUT = 30.0
+
+class TickScheduler:
+    """Paces a loop at rate ticks per second on absolute deadlines of the monotonic clock.
+
+    Tick k is due at start + k / rate, so oversleeping and slow ticks never accumulate
+    into a lower rate. A tick that is already due when the previous one finishes is an
+    overrun and runs immediately. With "catch_up" every missed deadline still gets its
+    tick, back to back, until the schedule is met again; with "skip" deadlines missed
+    entirely are dropped (and counted) so the next tick keeps to the original phase.
+    """
+    def __init__(self, rate, policy="skip"):
+        if policy not in TICK_POLICIES:
+            raise ValueError(f"unknown tick policy {policy!r}, expected one of {TICK_POLICIES}")
+        self.rate = rate
+        self.policy = policy
+        self.period_ns = round(1e9 / rate)
+        self.start_ns = None
+        self.last_start_ns = None
+        self.next_tick = 0
+
+        # Statistics: ticks run, ticks that started overdue, deadlines skipped, and how late ticks started
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.lateness = LatencyHistogram()
+
+    def start(self, start_ns=None):
+        """Begin the schedule; tick 0 runs now (or was due at start_ns)."""
+        self.start_ns = time.monotonic_ns() if start_ns is None else start_ns
+        self.last_start_ns = self.start_ns
+        self.next_tick = 1
+        self.ticks = 1
+
+    def deadline(self):
+        """Monotonic time (ns) the next tick is due."""
+        return self.start_ns + self.next_tick * self.period_ns
+
+    def sleep_time(self):
+        """Seconds to sleep before the next tick, after applying the policy if we are behind."""
+        now = time.monotonic_ns()
+        deadline = self.deadline()
+        if now < deadline:
+            return (deadline - now) / 1e9
+
+        self.overruns += 1
+        missed = (now - deadline) // self.period_ns
+        if self.policy == "skip" and missed:
+            self.skipped += missed
+            self.next_tick += missed
+        return 0.0
+
+    def tick_started(self):
+        """Record how late the tick that is starting now is; call right after sleeping."""
+        self.last_start_ns = time.monotonic_ns()
+        self.lateness.add(self.last_start_ns - self.deadline())
+        self.next_tick += 1
+        self.ticks += 1
+
+    def wait(self):
+        """Sleep until the next tick is due."""
+        time.sleep(self.sleep_time())
+        self.tick_started()
+
+    def summary(self):
+        """Target and achieved rate, overruns, skipped ticks and tick start lateness (jitter)."""
+        # Rate over the span from the first tick's start to the last one's
+        elapsed = (self.last_start_ns - self.start_ns) / 1e9 if self.start_ns is not None else 0.0
+        return {
+            "rate": self.rate,
+            "policy": self.policy,
+            "ticks": self.ticks,
+            "achieved_rate": (self.ticks - 1) / elapsed if elapsed > 0 else 0.0,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "lateness": self.lateness.summary(),
+        }
+
+class StartBarrier:
+    """Readiness barrier that also gives every party one common start instant.
+
+    Each machine process (and the launcher) calls wait() once it is ready; the last one to
+    arrive sets the start instant START_LEAD_NS ahead on the monotonic clock, which is
+    shared by every process on the host. wait() sleeps until that instant and returns it,
+    so all run loops tick on the same schedule. If a party fails to arrive within timeout
+    (or calls abort()), wait() raises threading.BrokenBarrierError everywhere.
+
+    A held barrier leaves the start instant to the launcher: it calls ready() instead of
+    wait(), and once that returns (every machine is listening) release() with the instant,
+    e.g. one agreed with the launchers on other hosts (see cluster.py).
+    """
+    def __init__(self, parties, lead_ns=START_LEAD_NS, timeout=START_TIMEOUT, hold=False):
+        self.lead_ns = lead_ns
+        self.timeout = timeout
+        self.start = multiprocessing.Value("q", 0)
+        self.released = multiprocessing.Event()
+        self.barrier = multiprocessing.Barrier(parties, action=None if hold else self._set_start, timeout=timeout)
+
+    def _set_start(self):
+        self.release(time.monotonic_ns() + self.lead_ns)
+
+    def wait(self):
+        """Block until all parties are ready and the start instant has come; returns it (monotonic ns)."""
+        self.barrier.wait()
+        # Held barriers are released by the launcher after they pass
+        if not self.released.wait(self.timeout) or self.start.value < 0:
+            raise threading.BrokenBarrierError
+        start_ns = self.start.value
+        time.sleep(max(0, start_ns - time.monotonic_ns()) / 1e9)
+        return start_ns
+
+    def ready(self):
+        """Launcher side of a held barrier: block until every other party is ready, without starting them."""
+        self.barrier.wait()
+
+    def release(self, start_ns):
+        """Start every party at start_ns (monotonic ns)."""
+        self.start.value = start_ns
+        self.released.set()
+
+    def abort(self):
+        """Release every waiting party with BrokenBarrierError, e.g. when a machine failed to start."""
+        self.start.value = -1
+        self.released.set()
+        self.barrier.abort()
+
+def trial_parallelism(requested, n_trials, processes_per_trial, cpu_count=None):
+    """How many trials to run at once: as many as requested (0 or None: as many as fit), with at most one process per core."""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    fit = max(1, cpu_count // max(1, processes_per_trial))
+    return max(1, min(requested or fit, fit, n_trials))
+
+def run_trials(run_trial, n_trials, parallel):
+    """Call run_trial(trial, slot) for every trial, up to parallel at a time; returns the trials that failed.
+
+    Each running trial holds a slot in range(parallel), which it can use for resources
+    concurrent trials must not share (e.g. a port range). With parallel above 1 every
+    trial runs in a process of its own; otherwise they run here, one after another.
+    A trial fails by raising (its process exiting nonzero); later trials still run.
+    """
+    if parallel <= 1:
+        failed = []
+        for trial in range(n_trials):
+            try:
+                run_trial(trial, 0)
+            except Exception:
+                # Report it as a trial process would, and go on with the sweep
+                traceback.print_exc()
+                failed.append(trial)
+        return failed
+
+    free = list(range(parallel))
+    running = {}
+    failed = []
+
+    def wait_for_any():
+        ended = multiprocessing.connection.wait([p.sentinel for p in running])
+        for p in [p for p in running if p.sentinel in ended]:
+            p.join()
+            slot, trial = running.pop(p)
+            free.append(slot)
+            if p.exitcode != 0:
+                failed.append(trial)
+
+    for trial in range(n_trials):
+        while not free:
+            wait_for_any()
+        slot = min(free)
+        free.remove(slot)
+        # Not a daemon: the trial starts processes of its own
+        p = multiprocessing.Process(target=run_trial, args=(trial, slot))
+        p.start()
+        running[p] = (slot, trial)
+    while running:
+        wait_for_any()
+    return sorted(failed)
@@ -0,0 +1,249 @@
+import platform
+import socket
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from wire import MESSAGE_BODY, Message
+
+# Each ring holds fixed-size packed Message records (the body of a binary frame)
+RECORD = MESSAGE_BODY
+# Records per ring, one ring per (sender, receiver) pair
+RING_SLOTS = 4096
+
+# Ring header, in 8-byte words: the producer's tail on its own cache line, then the
+# consumer's head and its "waiting for a wakeup" flag on the next one
+TAIL, HEAD, WAITING = 0, 8, 9
+HEADER_BYTES = 128
+
+# How long a producer waits for room in a full ring before giving up on a send
+FULL_TIMEOUT = 1.0
+# Longest a consumer sleeps without a wakeup, in case one is missed
+IDLE_TIMEOUT = 0.01
+
+# The rings rely on the host not reordering stores (see Ring), and the doorbell is an
+# abstract Unix socket, so the transport is only available on Linux on x86-64
+SUPPORTED_MACHINES = ("x86_64", "amd64")
+
+def check_platform():
+    """Raise ValueError unless this host can run the shm transport."""
+    if not sys.platform.startswith("linux") or platform.machine().lower() not in SUPPORTED_MACHINES:
+        raise ValueError(f"the shm transport needs Linux on x86-64, not {sys.platform} on {platform.machine()}")
+
+# Rings created by this process, which its resource tracker already knows about
+_created = set()
+
+def ring_name(sender_port, receiver_port):
+    return f"lamport_ring_{sender_port}_{receiver_port}"
+
+def doorbell_address(port):
+    # Abstract Unix socket (Linux): nothing to clean up on disk
+    return f"\0lamport_doorbell_{port}"
+
+def decode_records(data: bytes) -> list:
+    """Messages packed back to back in data."""
+    return [Message(sender_id, logical_clock, send_ns or None, None if seq < 0 else seq)
+            for sender_id, logical_clock, send_ns, seq in RECORD.iter_unpack(data)]
+
+class Ring:
+    """Single-producer / single-consumer ring buffer of records in a shared memory segment.
+
+    Head and tail count records ever read / written, so the ring is empty when they are
+    equal and full when they are RING_SLOTS apart. Each side only writes its own index,
+    after copying the records; this relies on the host not reordering stores (x86-64).
+    """
+    def __init__(self, name, slots=RING_SLOTS, create=False):
+        if create:
+            size = HEADER_BYTES + slots * RECORD.size
+            try:
+                self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+            except FileExistsError:
+                # Left behind by a run that did not shut down cleanly
+                stale = shared_memory.SharedMemory(name)
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+            _created.add(name)
+        else:
+            self.shm = shared_memory.SharedMemory(name)
+            # Only the creator may unlink the segment; don't let our exit remove it
+            if name not in _created:
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.owner = create
+        # The creator chose the number of slots
+        self.slots = (self.shm.size - HEADER_BYTES) // RECORD.size
+        self.size = self.slots * RECORD.size
+        self.header = self.shm.buf[:HEADER_BYTES].cast("Q")
+        self.data = self.shm.buf[HEADER_BYTES:]
+
+    def write(self, records: bytes, timeout=FULL_TIMEOUT):
+        """Append packed records, waiting up to timeout for room; returns whether the consumer is waiting."""
+        header = self.header
+        n = len(records) // RECORD.size
+        tail = header[TAIL]
+        start = (tail % self.slots) * RECORD.size
+        if n <= self.slots - (tail - header[HEAD]) and start + len(records) <= self.size:
+            # Common case: room for everything without wrapping around
+            self.data[start:start + len(records)] = records
+            header[TAIL] = tail + n
+            return bool(header[WAITING])
+
+        offset = 0
+        while offset < n:
+            tail = header[TAIL]
+            free = self.slots - (tail - header[HEAD])
+            if not free:
+                deadline = time.monotonic() + timeout
+                while header[HEAD] + self.slots == tail:
+                    if time.monotonic() > deadline:
+                        raise BufferError(f"ring {self.shm.name} full")
+                    time.sleep(0.0005)
+                continue
+            count = min(free, n - offset)
+            chunk = records[offset * RECORD.size:(offset + count) * RECORD.size]
+            start = (tail % self.slots) * RECORD.size
+            first = min(len(chunk), self.size - start)
+            self.data[start:start + first] = chunk[:first]
+            if first < len(chunk):
+                self.data[:len(chunk) - first] = chunk[first:]
+            header[TAIL] = tail + count
+            offset += count
+        return bool(header[WAITING])
+
+    def read(self) -> bytes:
+        """Remove and return every record written so far."""
+        header = self.header
+        head, tail = header[HEAD], header[TAIL]
+        if head == tail:
+            return b""
+        start = (head % self.slots) * RECORD.size
+        end = (tail % self.slots) * RECORD.size
+        if start < end:
+            data = bytes(self.data[start:end])
+        else:
+            data = bytes(self.data[start:]) + bytes(self.data[:end])
+        header[HEAD] = tail
+        return data
+
+    def set_waiting(self, waiting: bool):
+        self.header[WAITING] = int(waiting)
+
+    def close(self):
+        self.header.release()
+        self.data.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _created.discard(self.shm.name)
+
+class ShmPeerLink:
+    """Producer end of the ring to one peer on this host, attached on first send."""
+    def __init__(self, port: int, peer_port: int):
+        self.name = ring_name(port, peer_port)
+        self.doorbell = doorbell_address(peer_port)
+        self.ring = None
+        self.lock = threading.Lock()
+        self.bell = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.bell.setblocking(False)
+
+    def send(self, data: bytes):
+        with self.lock:
+            if self.ring is None:
+                try:
+                    self.ring = Ring(self.name)
+                except FileNotFoundError:
+                    raise ConnectionError(f"peer ring {self.name} not created yet") from None
+            if self.ring.write(data):
+                # The consumer is asleep: one datagram wakes it for everything written
+                try:
+                    self.bell.sendto(b"\0", self.doorbell)
+                except OSError:
+                    # Its doorbell is already full (so it will wake) or it has gone away
+                    pass
+
+    def close(self):
+        with self.lock:
+            if self.ring is not None:
+                self.ring.close()
+                self.ring = None
+            self.bell.close()
+
+class ShmPeerPool:
+    """Rings to every peer, indexed like Machine.peers; a drop-in for transport.PeerPool."""
+    def __init__(self, port: int, peer_ports: list):
+        self.connections = [ShmPeerLink(port, peer_port) for peer_port in peer_ports]
+
+    def encode(self, message: Message) -> bytes:
+        send_ns = 0 if message.send_ns is None else message.send_ns
+        seq = -1 if message.seq is None else message.seq
+        return RECORD.pack(message.sender_id, message.logical_clock, send_ns, seq)
+
+    def send(self, target: int, data: bytes):
+        self.connections[target].send(data)
+
+    def take_credit(self, target: int):
+        # Senders block on a full ring instead
+        return True
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+
+class ShmInbound:
+    """Consumer ends of the rings from every peer, plus the doorbell producers ring to wake us.
+
+    serve() moves records from the rings into the machine's inbox. When every ring is empty
+    it raises the waiting flag in each, checks once more, then sleeps on the doorbell.
+    """
+    def __init__(self, port: int, peer_ports: list, slots=RING_SLOTS):
+        self.rings = [Ring(ring_name(peer_port, port), slots, create=True) for peer_port in peer_ports]
+        self.bell = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.bell.bind(doorbell_address(port))
+        self.bell.settimeout(IDLE_TIMEOUT)
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def drain(self) -> list:
+        """Messages waiting in every ring, oldest first per sender."""
+        messages = []
+        for ring in self.rings:
+            data = ring.read()
+            if data:
+                messages.extend(decode_records(data))
+        return messages
+
+    def serve(self, put_many):
+        """Move messages into put_many until closed (run on a daemon thread)."""
+        while not self.closed:
+            with self.lock:
+                if self.closed:
+                    return
+                messages = self.drain()
+                if not messages:
+                    for ring in self.rings:
+                        ring.set_waiting(True)
+                    messages = self.drain()
+            if messages:
+                enqueue_ns = time.monotonic_ns()
+                for message in messages:
+                    message.enqueue_ns = enqueue_ns
+                put_many(messages)
+                continue
+            try:
+                self.bell.recv(64)
+            except (socket.timeout, OSError):
+                pass
+            with self.lock:
+                if not self.closed:
+                    for ring in self.rings:
+                        ring.set_waiting(False)
+
+    def close(self):
+        """Stop serving and remove the rings."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            for ring in self.rings:
+                ring.close()
+            self.bell.close()
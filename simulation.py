@@ -0,0 +1,290 @@
+import heapq
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+from operator import itemgetter
+import yaml
+from topology import ActionModel, build_topology, full_mesh
+from event_log import create_run_folder, write_run_anchor
+
+# Lines buffered per machine before they are appended to its output file
+FLUSH_LINES = 10_000
+
+class SimMachine:
+    """State of one simulated machine: clock rate, logical clock and inbox."""
+    def __init__(self, machine_id: int, clock_rate: int, peers_id: list, actions: ActionModel):
+        self.machine_id = machine_id
+        self.clock_rate = clock_rate
+        self.cycle_time = 1 / clock_rate
+        self.peers_id = peers_id
+        self.actions = actions
+        self.logical_clock = 0
+        self.message_queue = deque()
+        self.ticks = 0
+        # Messages on the wire as (arrival time, sequence number, (sender id, clock))
+        self.in_flight = deque()
+
+        # Summary counters
+        self.counts = {"SENT": 0, "RECEIVED": 0, "INTERNAL": 0}
+        self.max_queue_length = 0
+
+        # Replays only: where we are in the recorded schedule (replay.ScheduleCursor), and
+        # the (operation, logical clock) of every event
+        self.cursor = None
+        self.trace = None
+
+class Simulation:
+    """Single-process discrete-event simulation of a cluster of machines in virtual time.
+
+    Reproduces Machine.run: every tick a machine handles one queued message or takes a
+    random action (send to one peer, all peers, or an internal event). Messages
+    arrive after network_delay (+ uniform jitter) virtual seconds, in FIFO order per pair.
+    topology is a list of peer id lists, one per machine (default: full mesh).
+
+    With schedules (one per machine, see replay.py) machines follow a recorded run's ticks
+    instead of drawing actions, and the simulation ends once every schedule is done.
+    """
+    def __init__(self, clock_rates: list, p_a, p_b, p_c, network_delay=0.0, delay_jitter=0.0, seed=None, log_path=None, log_format="log", start_time=None, topology=None, schedules=None):
+        n = len(clock_rates)
+        topology = topology if topology is not None else full_mesh(n)
+        self.machines = [SimMachine(i, cr, topology[i], ActionModel.from_thresholds(p_a, p_b, p_c, len(topology[i])))
+                         for i, cr in enumerate(clock_rates)]
+        self.network_delay = network_delay
+        self.delay_jitter = delay_jitter
+        self.rng = random.Random(seed)
+
+        # Output: "log" (machine_<id>.log text), "csv" (parsed machine_<id>.csv), or None
+        self.log_path = log_path
+        self.log_format = log_format if log_path else None
+        self.start_time = time.time() if start_time is None else start_time
+        self.buffers = [[] for _ in self.machines]
+        self._stamp_second = None
+        self._stamp = ""
+
+        # Priority queue of upcoming ticks as (virtual time, sequence number, machine id).
+        # Deliveries wait in each receiver's in_flight queue and are moved to its inbox
+        # at its next tick, so they never touch the global heap.
+        self.events = []
+        self.seq = 0
+        self.now = 0.0
+        # Last delivery time per (sender, receiver), to keep each link FIFO
+        self.last_delivery = {}
+        # Ticks simulated so far
+        self.events_processed = 0
+
+        # Machines still running: a replay is over once every schedule has been followed
+        self.active = len(self.machines)
+        if schedules is not None:
+            from replay import ScheduleCursor
+            self._tick = self._replay_tick
+            for m, schedule in zip(self.machines, schedules):
+                # Queued messages are (sender id, clock) pairs
+                m.cursor = ScheduleCursor(schedule, m.peers_id, itemgetter(0))
+                m.trace = []
+            self.active = sum(1 for schedule in schedules if schedule)
+
+    def _schedule(self, at, machine_id):
+        heapq.heappush(self.events, (at, self.seq, machine_id))
+        self.seq += 1
+
+    def _timestamp(self):
+        """Wall-clock style timestamp for the current virtual time (cached per second)."""
+        second = int(self.start_time + self.now)
+        if second != self._stamp_second:
+            self._stamp_second = second
+            self._stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+        return self._stamp
+
+    def _record(self, m: SimMachine, operation, peer=None, queue_length=0):
+        """Record an event in the same schema as Machine's log / parsed CSV."""
+        m.counts[operation] += 1
+        if self.log_format is None:
+            return
+        # Virtual time stands in for the monotonic clock (anchored at start_time)
+        mono_ns = round(self.now * 1e9)
+        if self.log_format == "csv":
+            line = f"{self._timestamp()},{operation},{m.logical_clock},{queue_length},{mono_ns}\n"
+        elif operation == "SENT":
+            line = f"{self._timestamp()} - [SENT] to Machine {peer}, Logical clock: {m.logical_clock}, Monotonic ns: {mono_ns}\n"
+        elif operation == "RECEIVED":
+            line = f"{self._timestamp()} - [RECEIVED] from Machine {peer}, Logical clock: {m.logical_clock}, Queue length: {queue_length}, Monotonic ns: {mono_ns}\n"
+        else:
+            line = f"{self._timestamp()} - [INTERNAL], Logical clock: {m.logical_clock}, Monotonic ns: {mono_ns}\n"
+        buf = self.buffers[m.machine_id]
+        buf.append(line)
+        if len(buf) >= FLUSH_LINES:
+            self._flush(m.machine_id)
+
+    def _output_file(self, machine_id):
+        ext = "csv" if self.log_format == "csv" else "log"
+        return os.path.join(self.log_path, f"machine_{machine_id}.{ext}")
+
+    def _flush(self, machine_id):
+        buf = self.buffers[machine_id]
+        if buf:
+            with open(self._output_file(machine_id), "a") as f:
+                f.writelines(buf)
+            buf.clear()
+
+    def _open_outputs(self):
+        """Create output files with their header lines."""
+        os.makedirs(self.log_path, exist_ok=True)
+        for m in self.machines:
+            with open(self._output_file(m.machine_id), "w") as f:
+                if self.log_format == "csv":
+                    f.write("timestamp,operation,logical_clock,queue_length,mono_ns\n")
+                else:
+                    f.write(f"{self._timestamp()} - [INIT] with clock rate {m.clock_rate} and peers {m.peers_id}, {m.peers_id}\n")
+        with open(os.path.join(self.log_path, "clock_rates.json"), "w") as f:
+            json.dump({f"machine_{m.machine_id}": m.clock_rate for m in self.machines}, f)
+        write_run_anchor(self.log_path, epoch_ns=round(self.start_time * 1e9), mono_ns=0)
+
+    def _send(self, m: SimMachine, target):
+        """Send a message to the target'th peer of m."""
+        receiver = m.peers_id[target]
+        self._record(m, "SENT", receiver)
+        at = self.now + self.network_delay
+        payload = (m.machine_id, m.logical_clock)
+        in_flight = self.machines[receiver].in_flight
+        if self.delay_jitter:
+            at += self.rng.uniform(0, self.delay_jitter)
+            # Streams are ordered, so a message never overtakes an earlier one on the same link
+            link = (m.machine_id, receiver)
+            at = max(at, self.last_delivery.get(link, 0.0))
+            self.last_delivery[link] = at
+            heapq.heappush(in_flight, (at, self.seq, payload))
+        else:
+            # With a fixed delay arrivals are already in time order
+            in_flight.append((at, self.seq, payload))
+        self.seq += 1
+
+    def _deliver(self, m: SimMachine):
+        """Move every message that has arrived by now into m's inbox."""
+        in_flight = m.in_flight
+        queue = m.message_queue
+        if self.delay_jitter:
+            while in_flight and in_flight[0][0] <= self.now:
+                queue.append(heapq.heappop(in_flight)[2])
+        else:
+            while in_flight and in_flight[0][0] <= self.now:
+                queue.append(in_flight.popleft()[2])
+        if len(queue) > m.max_queue_length:
+            m.max_queue_length = len(queue)
+
+    def _tick(self, m: SimMachine):
+        """Process one clock tick, exactly as Machine.run does."""
+        if m.in_flight:
+            self._deliver(m)
+        if m.message_queue:
+            sender_id, clock = m.message_queue.popleft()
+            # Update clock according to Lamport
+            m.logical_clock = max(m.logical_clock, clock) + 1
+            self._record(m, "RECEIVED", sender_id, len(m.message_queue))
+        else:
+            targets = m.actions.choose(self.rng)
+            if targets:
+                for i in targets:
+                    self._send(m, i)
+                m.logical_clock += 1
+            # Trigger an internal event
+            else:
+                m.logical_clock += 1
+                self._record(m, "INTERNAL")
+
+    def _replay_tick(self, m: SimMachine):
+        """Process one clock tick by m's recorded schedule; a receive step waits until its messages arrive."""
+        if m.cursor.done():
+            return
+        if m.in_flight:
+            self._deliver(m)
+        arrived = list(m.message_queue)
+        m.message_queue.clear()
+        step = m.cursor.next_step(arrived)
+        if step is None:
+            return
+        kind, items = step[:2]
+        if kind == "send":
+            for i in items:
+                self._send(m, i)
+                m.trace.append(("SENT", m.logical_clock))
+            m.logical_clock += 1
+        elif kind == "internal":
+            m.logical_clock += 1
+            self._record(m, "INTERNAL")
+            m.trace.append(("INTERNAL", m.logical_clock))
+        else:
+            if kind == "drain":
+                m.logical_clock = max(m.logical_clock, max(clock for _, clock in items)) + 1
+            for sender_id, clock in items:
+                if kind == "receive":
+                    m.logical_clock = max(m.logical_clock, clock) + 1
+                self._record(m, "RECEIVED", sender_id, step[2])
+                m.trace.append(("RECEIVED", m.logical_clock))
+        if m.cursor.done():
+            self.active -= 1
+
+    def run(self, duration):
+        """Simulate duration virtual seconds and return per-machine summaries."""
+        if self.log_format:
+            self._open_outputs()
+        for m in self.machines:
+            # Jittered links need a heap per receiver; fixed delays keep a plain FIFO
+            m.in_flight = [] if self.delay_jitter else deque()
+            self._schedule(0.0, m.machine_id)
+
+        events = self.events
+        machines = self.machines
+        while events and events[0][0] < duration and self.active:
+            self.now, _, machine_id = heapq.heappop(events)
+            m = machines[machine_id]
+            self._tick(m)
+            # Tick k happens at k / clock_rate, so rounding never accumulates
+            m.ticks += 1
+            self._schedule(m.ticks / m.clock_rate, machine_id)
+            self.events_processed += 1
+
+        if self.log_format:
+            for m in self.machines:
+                self._flush(m.machine_id)
+        return self.summary()
+
+    def summary(self):
+        """Final clock, event counts and max queue length per machine."""
+        return [{"machine_id": m.machine_id,
+                 "clock_rate": m.clock_rate,
+                 "logical_clock": m.logical_clock,
+                 "max_queue_length": m.max_queue_length,
+                 "queue_length": len(m.message_queue),
+                 **m.counts} for m in self.machines]
+
+if __name__ == "__main__":
+    # Usage: python simulation.py [N_MACHINES] [DURATION] -- defaults come from experiment_config.yaml
+    with open("experiment_config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+    n_machines = int(sys.argv[1]) if len(sys.argv) > 1 else config["N_MACHINES"]
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else config["DURATION"]
+    # Every random draw comes from SEED (picked here if unset), recorded in config.yaml to rerun the simulation exactly
+    seed = config.get("SEED")
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(63)
+    rng = random.Random(seed)
+    config = {**config, "N_MACHINES": n_machines, "DURATION": duration, "SEED": seed}
+
+    log_folder = create_run_folder(f"run_sim_{int(time.time())}")
+    with open(f"{log_folder}/config.yaml", "w") as f:
+        yaml.dump(config, f)
+
+    clock_rates = [rng.randint(1, config["CYCLE_MAX"]) for _ in range(n_machines)]
+    topology = build_topology(config.get("TOPOLOGY", "full_mesh"), n_machines, degree=config.get("TOPOLOGY_DEGREE"), seed=rng.getrandbits(64))
+    sim = Simulation(clock_rates, config["PROB_MSG_A"], config["PROB_MSG_B"], config["PROB_MSG_C"], topology=topology,
+                     network_delay=config.get("SIM_NETWORK_DELAY", 0.0), seed=rng.getrandbits(64),
+                     delay_jitter=config.get("SIM_DELAY_JITTER", 0.0),
+                     log_path=log_folder, log_format=config.get("SIM_LOG_FORMAT", "log"))
+    start = time.perf_counter()
+    sim.run(duration)
+    elapsed = time.perf_counter() - start
+    print(f"Simulated {n_machines} machines for {duration:g} virtual seconds "
+          f"({sim.events_processed:,} ticks) in {elapsed:.2f}s -> {log_folder}")
@@ -0,0 +1,172 @@
+import itertools
+import math
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import yaml
+
+def simulate_batch(clock_rates, p_a, p_b, p_c, duration, queue_capacity=1024, seed=None):
+    """Simulate many independent full-mesh trials of Machine.run in lockstep NumPy arrays.
+
+    clock_rates: (T, N) integer clock rates, one row per trial
+    p_a, p_b, p_c: (T,) probability thresholds per trial (out of 10, as in experiment_config.yaml)
+    duration: virtual seconds to simulate
+    Messages become visible to the receiver on its next tick. Each inbox is a ring buffer of
+    queue_capacity clocks; messages beyond that are dropped and counted in "dropped".
+    Returns a DataFrame with one row of summary metrics per trial.
+    """
+    rng = np.random.default_rng(seed)
+    clock_rates = np.asarray(clock_rates, dtype=np.int64)
+    T, N = clock_rates.shape
+    p_a = np.asarray(p_a).reshape(T, 1)
+    p_b = np.asarray(p_b).reshape(T, 1)
+    p_c = np.asarray(p_c).reshape(T, 1)
+    Q = queue_capacity
+
+    # Advance on a common grid fine enough that every clock rate ticks on a grid step
+    steps_per_sec = math.lcm(*np.unique(clock_rates).tolist())
+    period = steps_per_sec // clock_rates
+    n_steps = int(round(duration * steps_per_sec))
+    # Only visit grid steps on which at least one machine ticks
+    tick_steps = np.unique(np.concatenate([np.arange(0, n_steps, steps_per_sec // r) for r in np.unique(clock_rates)]))
+
+    # Machine state
+    clock = np.zeros((T, N), dtype=np.int64)
+    buf = np.zeros((T, N, Q), dtype=np.int64)
+    head = np.zeros((T, N), dtype=np.int64)
+    size = np.zeros((T, N), dtype=np.int64)
+
+    # Per-trial metrics (max_queue is the peak inbox depth seen by any machine)
+    sent = np.zeros(T, dtype=np.int64)
+    received = np.zeros(T, dtype=np.int64)
+    internal = np.zeros(T, dtype=np.int64)
+    dropped = np.zeros(T, dtype=np.int64)
+    jump_sum = np.zeros(T, dtype=np.int64)
+    max_jump = np.zeros(T, dtype=np.int64)
+    queue_sum = np.zeros(T, dtype=np.int64)
+    max_queue = np.zeros(T, dtype=np.int64)
+    drift_sum = np.zeros(T, dtype=np.int64)
+    max_drift = np.zeros(T, dtype=np.int64)
+    drift_samples = 0
+
+    rows = np.arange(T)
+    # peer k of machine i is machine k if k < i else k + 1 (the ordering used by main.py)
+    peers = [[j for j in range(N) if j != i] for i in range(N)]
+
+    for step in tick_steps.tolist():
+        ticking = step % period == 0
+        if ticking.any():
+            # 1) Machines with a queued message take one and apply Lamport's rule
+            t_idx, n_idx = np.nonzero(ticking & (size > 0))
+            if t_idx.size:
+                msg = buf[t_idx, n_idx, head[t_idx, n_idx] % Q]
+                old = clock[t_idx, n_idx]
+                new = np.maximum(old, msg) + 1
+                clock[t_idx, n_idx] = new
+                head[t_idx, n_idx] += 1
+                size[t_idx, n_idx] -= 1
+                np.add.at(received, t_idx, 1)
+                np.add.at(jump_sum, t_idx, new - old)
+                np.maximum.at(max_jump, t_idx, new - old)
+                # Queue length left behind, as logged on [RECEIVED]
+                np.add.at(queue_sum, t_idx, size[t_idx, n_idx])
+
+            # 2) The rest draw an action, as in Machine.run
+            acting = ticking & (size == 0)
+            acting[t_idx, n_idx] = False
+            draws = rng.integers(1, 11, size=(T, N))
+            to_one = acting & (draws < np.maximum(p_a, p_b))
+            to_all = acting & ~to_one & (draws < p_c)
+            internal += (acting & ~to_one & ~to_all).sum(axis=1)
+            # Which peer a single message goes to: A/B by threshold with two peers,
+            # uniform over all peers otherwise (see topology.ActionModel.from_thresholds)
+            if N == 2:
+                target = np.zeros((T, N), dtype=np.int64)
+            elif N == 3:
+                target = (draws >= p_a).astype(np.int64)
+            else:
+                target = rng.integers(0, N - 1, size=(T, N))
+
+            # Messages carry the pre-increment clock and are appended in sender order
+            for i in range(N):
+                for k, j in enumerate(peers[i]):
+                    mask = to_all[:, i] | (to_one[:, i] & (target[:, i] == k))
+                    if not mask.any():
+                        continue
+                    t_send = rows[mask]
+                    sent[t_send] += 1
+                    full = size[t_send, j] >= Q
+                    dropped[t_send[full]] += 1
+                    t_send = t_send[~full]
+                    tail = (head[t_send, j] + size[t_send, j]) % Q
+                    buf[t_send, j, tail] = clock[t_send, i]
+                    size[t_send, j] += 1
+                    np.maximum.at(max_queue, t_send, size[t_send, j])
+
+            # Every action advances the clock by one
+            clock += acting
+
+        # Sample drift (spread of logical clocks across machines) once per virtual second;
+        # whole seconds are always tick steps since every period divides steps_per_sec
+        if step % steps_per_sec == 0:
+            spread = clock.max(axis=1) - clock.min(axis=1)
+            drift_sum += spread
+            np.maximum(max_drift, spread, out=max_drift)
+            drift_samples += 1
+
+    return pd.DataFrame({
+        "sent": sent,
+        "received": received,
+        "internal": internal,
+        "dropped": dropped,
+        "final_drift": clock.max(axis=1) - clock.min(axis=1),
+        "mean_drift": drift_sum / max(drift_samples, 1),
+        "max_drift": max_drift,
+        "mean_jump": jump_sum / np.maximum(received, 1),
+        "max_jump": max_jump,
+        "mean_queue_length": queue_sum / np.maximum(received, 1),
+        "max_queue_length": max_queue,
+        "final_queue_length": size.max(axis=1),
+    })
+
+def sweep(cycle_max_values, prob_values, n_machines=3, trials=1, duration=60, chunk_size=2048, queue_capacity=1024, seed=None):
+    """Run every (CYCLE_MAX, (PROB_MSG_A, PROB_MSG_B, PROB_MSG_C)) point trials times.
+
+    Clock rates are drawn per machine from 1..CYCLE_MAX, as main.py does. Trials are
+    simulated chunk_size at a time to bound memory. Returns one row per trial.
+    """
+    rng = np.random.default_rng(seed)
+    points = [(cm, pa, pb, pc) for cm, (pa, pb, pc) in itertools.product(cycle_max_values, prob_values)]
+    params = np.repeat(np.array(points, dtype=np.int64), trials, axis=0)
+    results = []
+    for start in range(0, len(params), chunk_size):
+        chunk = params[start:start + chunk_size]
+        cycle_max = chunk[:, 0:1]
+        clock_rates = 1 + np.floor(rng.random((len(chunk), n_machines)) * cycle_max).astype(np.int64)
+        df = simulate_batch(clock_rates, chunk[:, 1], chunk[:, 2], chunk[:, 3], duration,
+                            queue_capacity=queue_capacity, seed=rng.integers(2**63))
+        df.insert(0, "CYCLE_MAX", chunk[:, 0])
+        df.insert(1, "PROB_MSG_A", chunk[:, 1])
+        df.insert(2, "PROB_MSG_B", chunk[:, 2])
+        df.insert(3, "PROB_MSG_C", chunk[:, 3])
+        df.insert(4, "clock_rates", [",".join(map(str, r)) for r in clock_rates])
+        results.append(df)
+    return pd.concat(results, ignore_index=True)
+
+if __name__ == "__main__":
+    # Usage: python sweep.py [TRIALS_PER_POINT] -- sweeps CYCLE_MAX 1..10 and every a <= b <= c threshold triple
+    with open("experiment_config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+    trials = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    prob_values = [(a, b, c) for a in range(0, 11) for b in range(a, 11) for c in range(b, 11)]
+
+    start = time.perf_counter()
+    df = sweep(range(1, 11), prob_values, n_machines=config["N_MACHINES"], trials=trials, duration=config["DURATION"])
+    elapsed = time.perf_counter() - start
+
+    os.makedirs("logs", exist_ok=True)
+    out_path = f"logs/sweep_{int(time.time())}.csv"
+    df.to_csv(out_path, index=False)
+    print(f"Simulated {len(df):,} trials of {config['DURATION']}s in {elapsed:.1f}s -> {out_path}")
@@ -25,7 +25,7 @@ _sym_db = _symbol_database.Default()
 from google.protobuf import empty_pb2 as google_dot_protobuf_dot_empty__pb2
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0csystem.proto\x12\x07machine\x1a\x1bgoogle/protobuf/empty.proto\"3\n\x07Message\x12\x11\n\tsender_id\x18\x01 \x01(\x05\x12\x15\n\rlogical_clock\x18\x02 \x01(\x05\x32\x85\x01\n\x0bPeerService\x12\x37\n\x0bSendMessage\x12\x10.machine.Message\x1a\x16.google.protobuf.Empty\x12=\n\x0fReceiveMessages\x12\x16.google.protobuf.Empty\x1a\x10.machine.Message0\x01\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0csystem.proto\x12\x07machine\x1a\x1bgoogle/protobuf/empty.proto\"Q\n\x07Message\x12\x11\n\tsender_id\x18\x01 \x01(\x05\x12\x15\n\rlogical_clock\x18\x02 \x01(\x03\x12\x0f\n\x07send_ns\x18\x03 \x01(\x03\x12\x0b\n\x03seq\x18\x04 \x01(\x03\"2\n\x0cMessageBatch\x12\"\n\x08messages\x18\x01 \x03(\x0b\x32\x10.machine.Message2\xc8\x01\n\x0bPeerService\x12\x37\n\x0bSendMessage\x12\x10.machine.Message\x1a\x16.google.protobuf.Empty\x12=\n\x0fReceiveMessages\x12\x16.google.protobuf.Empty\x1a\x10.machine.Message0\x01\x12\x41\n\x0eStreamMessages\x12\x15.machine.MessageBatch\x1a\x16.google.protobuf.Empty(\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -33,7 +33,9 @@ _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'system_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
   _globals['_MESSAGE']._serialized_start=54
-  _globals['_MESSAGE']._serialized_end=105
-  _globals['_PEERSERVICE']._serialized_start=108
-  _globals['_PEERSERVICE']._serialized_end=241
+  _globals['_MESSAGE']._serialized_end=135
+  _globals['_MESSAGEBATCH']._serialized_start=137
+  _globals['_MESSAGEBATCH']._serialized_end=187
+  _globals['_PEERSERVICE']._serialized_start=190
+  _globals['_PEERSERVICE']._serialized_end=390
 # @@protoc_insertion_point(module_scope)
@@ -1,14 +1,25 @@
 from google.protobuf import empty_pb2 as _empty_pb2
+from google.protobuf.internal import containers as _containers
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
-from typing import ClassVar as _ClassVar, Optional as _Optional
+from typing import ClassVar as _ClassVar, Iterable as _Iterable, Mapping as _Mapping, Optional as _Optional, Union as _Union
 
 DESCRIPTOR: _descriptor.FileDescriptor
 
 class Message(_message.Message):
-    __slots__ = ("sender_id", "logical_clock")
+    __slots__ = ("sender_id", "logical_clock", "send_ns", "seq")
     SENDER_ID_FIELD_NUMBER: _ClassVar[int]
     LOGICAL_CLOCK_FIELD_NUMBER: _ClassVar[int]
+    SEND_NS_FIELD_NUMBER: _ClassVar[int]
+    SEQ_FIELD_NUMBER: _ClassVar[int]
     sender_id: int
     logical_clock: int
-    def __init__(self, sender_id: _Optional[int] = ..., logical_clock: _Optional[int] = ...) -> None: ...
+    send_ns: int
+    seq: int
+    def __init__(self, sender_id: _Optional[int] = ..., logical_clock: _Optional[int] = ..., send_ns: _Optional[int] = ..., seq: _Optional[int] = ...) -> None: ...
+
+class MessageBatch(_message.Message):
+    __slots__ = ("messages",)
+    MESSAGES_FIELD_NUMBER: _ClassVar[int]
+    messages: _containers.RepeatedCompositeFieldContainer[Message]
+    def __init__(self, messages: _Optional[_Iterable[_Union[Message, _Mapping]]] = ...) -> None: ...
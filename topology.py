@@ -0,0 +1,136 @@
+import random
+
+def full_mesh(n: int):
+    """Every machine is a peer of every other machine."""
+    return [[j for j in range(n) if j != i] for i in range(n)]
+
+def ring(n: int):
+    """Each machine is connected to its two neighbours on a ring."""
+    if n < 2:
+        return [[] for _ in range(n)]
+    return [sorted({(i - 1) % n, (i + 1) % n} - {i}) for i in range(n)]
+
+def star(n: int, hub=0):
+    """The hub is connected to every machine; every other machine only to the hub."""
+    return [[j for j in range(n) if j != i] if i == hub else [hub] for i in range(n)]
+
+def random_regular(n: int, k: int, seed=None, max_restarts=1000):
+    """Random k-regular graph on n machines (each machine has exactly k distinct peers).
+
+    Uses the pairing model: match up the n * k endpoint stubs at random, rejecting
+    self-loops and duplicate edges, and restart from scratch if we get stuck.
+    """
+    if k >= n or (n * k) % 2:
+        raise ValueError(f"no {k}-regular graph on {n} machines")
+    rng = random.Random(seed)
+    for _ in range(max_restarts):
+        adjacency = [set() for _ in range(n)]
+        stubs = [i for i in range(n) for _ in range(k)]
+        while stubs:
+            # Try a bounded number of random pairings before declaring this attempt stuck
+            for _ in range(100):
+                a = rng.randrange(len(stubs))
+                b = rng.randrange(len(stubs))
+                u, v = stubs[a], stubs[b]
+                if a != b and u != v and v not in adjacency[u]:
+                    break
+            else:
+                break
+            adjacency[u].add(v)
+            adjacency[v].add(u)
+            for idx in sorted((a, b), reverse=True):
+                stubs[idx] = stubs[-1]
+                stubs.pop()
+        if not stubs:
+            return [sorted(peers) for peers in adjacency]
+    raise RuntimeError(f"could not build a random {k}-regular graph on {n} machines")
+
+# Topology names accepted in experiment_config.yaml
+TOPOLOGIES = {
+    "full_mesh": full_mesh,
+    "ring": ring,
+    "star": star,
+    "random_regular": random_regular,
+}
+
+def build_topology(name: str, n: int, degree=None, seed=None):
+    """Build the peer lists for n machines from a topology name."""
+    if name not in TOPOLOGIES:
+        raise ValueError(f"unknown topology {name!r}, expected one of {sorted(TOPOLOGIES)}")
+    if name == "random_regular":
+        return random_regular(n, degree, seed=seed)
+    return TOPOLOGIES[name](n)
+
+class AliasTable:
+    """Walker's alias method: O(1) sampling of an index with probability proportional to its weight."""
+    def __init__(self, weights: list):
+        n = len(weights)
+        total = float(sum(weights))
+        if n == 0 or total <= 0:
+            raise ValueError("weights must contain a positive entry")
+        scaled = [w * n / total for w in weights]
+        self.prob = [0.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def sample(self, rng):
+        """Draw an index using rng.random()."""
+        u = rng.random() * len(self.prob)
+        i = int(u)
+        return i if u - i < self.prob[i] else self.alias[i]
+
+class ActionModel:
+    """Per-tick action distribution: message one weighted peer, message all peers, or internal event."""
+    def __init__(self, p_unicast: float, p_broadcast: float, weights: list):
+        self.n_peers = len(weights)
+        self.all_peers = list(range(self.n_peers))
+        # Without peers every action is an internal event
+        if self.n_peers == 0 or sum(weights) <= 0:
+            p_unicast = 0.0
+        if self.n_peers == 0:
+            p_broadcast = 0.0
+        self.p_unicast = p_unicast
+        self.p_send = p_unicast + p_broadcast
+        self.table = AliasTable(weights) if p_unicast > 0 else None
+
+    @staticmethod
+    def from_thresholds(p_a, p_b, p_c, n_peers: int, weights=None):
+        """Build the model from the PROB_MSG_A/B/C thresholds (out of 10) in experiment_config.yaml.
+
+        An action is drawn from 1..10: below p_a messages peer A, below p_b peer B, below p_c
+        every peer, otherwise an internal event. With more than two peers the unicast share
+        is spread over all peers (uniformly unless weights are given) instead of only A and B.
+        """
+        def below(threshold):
+            return min(max(threshold - 1, 0), 10)
+        n_a = below(p_a)
+        n_b = max(below(p_b) - n_a, 0)
+        n_all = max(below(p_c) - n_a - n_b, 0)
+        if weights is None:
+            if n_peers <= 2:
+                weights = [n_a, n_b][:n_peers]
+                # Single peer: it receives both peer A's and peer B's share
+                if n_peers == 1:
+                    weights = [n_a + n_b]
+            else:
+                weights = [1] * n_peers
+        return ActionModel((n_a + n_b) / 10, n_all / 10, weights)
+
+    def choose(self, rng):
+        """Return the peer indices to message this tick; an empty list means an internal event."""
+        r = rng.random()
+        if r < self.p_unicast:
+            return [self.table.sample(rng)]
+        if r < self.p_send:
+            return self.all_peers
+        return []
@@ -0,0 +1,229 @@
+import socket
+import threading
+import time
+from wire import FrameDecoder, credit_frame
+
+# How long a sender waits, on a fresh credit-controlled stream, for the peer's first grant
+GRANT_TIMEOUT = 0.05
+
+def peer_address(peer, host: str):
+    """(host, port) of a peer given as a port on host, a "host:port" string or a (host, port) pair."""
+    if isinstance(peer, str):
+        peer_host, _, port = peer.rpartition(":")
+        return peer_host or host, int(port)
+    if isinstance(peer, (tuple, list)):
+        return peer[0], int(peer[1])
+    return host, int(peer)
+
+class PeerConnection:
+    """Long-lived outbound stream to a single peer, reconnected on failure."""
+    def __init__(self, host: str, port: int, connect_timeout=1.0, retry_interval=0.5, credit=False, grant_timeout=GRANT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        # Minimum wait between reconnect attempts to a peer that is down
+        self.retry_interval = retry_interval
+        self.sock = None
+        self.lock = threading.Lock()
+        self._next_attempt = 0.0
+
+        # With credit flow control the peer grants credits on our stream, one per message we may send
+        self.credit = credit
+        self.credits = 0
+        self.decoder = FrameDecoder()
+        # Kept short: the wait holds up the sender's tick
+        self.grant_timeout = grant_timeout
+
+    def _connect(self):
+        # Back off instead of hammering a peer that refused us moments ago
+        now = time.monotonic()
+        if now < self._next_attempt:
+            raise ConnectionError(f"peer {self.host}:{self.port} unavailable, retrying later")
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        except OSError:
+            self._next_attempt = now + self.retry_interval
+            raise
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        # Credits belong to a stream; the peer grants new ones when it accepts this one
+        self.credits = 0
+        self.decoder = FrameDecoder()
+
+    def _drop(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def send(self, data: bytes):
+        """Write data to the peer, reconnecting once if the stream has broken."""
+        with self.lock:
+            if self.sock is None:
+                self._connect()
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                # Stale stream (e.g. peer restarted): retry on a fresh connection
+                self._drop()
+                self._connect()
+                self.sock.sendall(data)
+
+    def take_credit(self):
+        """Use up one credit if the peer has granted any; always True without credit flow control."""
+        if not self.credit:
+            return True
+        with self.lock:
+            try:
+                if self.sock is None:
+                    self._connect()
+                    self._await_grant()
+                self._read_credits()
+            except OSError:
+                self._drop()
+                return False
+            if self.credits <= 0:
+                return False
+            self.credits -= 1
+            return True
+
+    def _await_grant(self):
+        # The peer grants a stream its share from its accept thread, usually a moment after we
+        # connect; wait for that first grant so a fresh stream's first send isn't withheld
+        self.sock.settimeout(self.grant_timeout)
+        try:
+            while self.sock is not None and self.credits <= 0:
+                data = self.sock.recv(65536)
+                if not data:
+                    self._drop()
+                    return
+                self.credits += self.decoder.credits(data)
+        except socket.timeout:
+            pass
+        finally:
+            if self.sock is not None:
+                self.sock.settimeout(None)
+
+    def _read_credits(self):
+        # Collect credit frames the peer sent back, without waiting for more
+        while self.sock is not None:
+            try:
+                data = self.sock.recv(65536, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return
+            if not data:
+                # The peer closed the stream; reconnect on the next send
+                self._drop()
+                return
+            self.credits += self.decoder.credits(data)
+
+    def close(self):
+        with self.lock:
+            self._drop()
+
+class CreditLink:
+    """Receiving end of a credit-controlled stream: credits for its messages go back on it, and only it."""
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def grant(self, credits: int):
+        # Listener and run loop both grant; keep their frames whole
+        with self.lock:
+            if not self.closed:
+                self.sock.sendall(credit_frame(credits))
+
+    def close(self):
+        # The sender has moved to a new stream, which got its own share; nothing to return here
+        with self.lock:
+            self.closed = True
+
+class PeerPool:
+    """Pool of persistent connections, one per peer index."""
+    def __init__(self, addresses: list, credit=False):
+        # addresses: list of (host, port) tuples, indexed like Machine.peers
+        self.connections = [PeerConnection(host, port, credit=credit) for host, port in addresses]
+
+    def encode(self, message) -> bytes:
+        return message.to_bytes()
+
+    def send(self, target: int, data: bytes):
+        self.connections[target].send(data)
+
+    def take_credit(self, target: int):
+        return self.connections[target].take_credit()
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+
+class SendBatcher:
+    """Coalesces outgoing frames so each peer gets a single write per flush."""
+    def __init__(self, pool: PeerPool, flush_window=0.0):
+        self.pool = pool
+        # Seconds to hold frames before flushing; 0 flushes at the end of every tick
+        self.flush_window = flush_window
+        self.pending = [[] for _ in pool.connections]
+        self.first_enqueue = None
+
+        # Batching statistics
+        self.flushes = 0
+        self.batches = 0
+        self.messages = 0
+        self.max_batch = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def add(self, target: int, data: bytes):
+        """Queue a frame for a peer until the next flush."""
+        self.pending[target].append(data)
+        if self.first_enqueue is None:
+            self.first_enqueue = time.monotonic()
+
+    def due(self):
+        """Whether pending frames have waited out the flush window."""
+        if self.first_enqueue is None:
+            return False
+        return time.monotonic() - self.first_enqueue >= self.flush_window
+
+    def flush(self):
+        """Write every peer's pending frames and return a list of (target, error) failures."""
+        if self.first_enqueue is None:
+            return []
+        errors = []
+        for target, frames in enumerate(self.pending):
+            if not frames:
+                continue
+            try:
+                self.pool.send(target, b"".join(frames))
+            except Exception as e:
+                errors.append((target, e))
+            self.batches += 1
+            self.messages += len(frames)
+            self.max_batch = max(self.max_batch, len(frames))
+            self.pending[target] = []
+
+        # Latency is measured from the oldest frame in the flush
+        latency = time.monotonic() - self.first_enqueue
+        self.flushes += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.first_enqueue = None
+        return errors
+
+    def summary(self):
+        """Batch size and flush latency statistics."""
+        return {
+            "flush_window": self.flush_window,
+            "flushes": self.flushes,
+            "batches": self.batches,
+            "messages": self.messages,
+            "mean_batch_size": self.messages / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch,
+            "mean_flush_latency": self.total_latency / self.flushes if self.flushes else 0.0,
+            "max_flush_latency": self.max_latency,
+        }
@@ -0,0 +1,112 @@
+import json
+import struct
+
+# Every frame on a peer stream starts with a fixed header: payload length, frame type
+FRAME_HEADER = struct.Struct("!IB")
+
+# Frame types
+FRAME_MESSAGE = 1
+# Sent back by a receiver with credit flow control: the sender may send this many more messages
+FRAME_CREDIT = 2
+
+CREDIT_BODY = struct.Struct("!I")
+
+# Packed Message body: sender id (int32), logical clock (int64), send time (monotonic ns, int64),
+# sequence number on the sender -> receiver link (int64, -1 if untracked)
+MESSAGE_BODY = struct.Struct("!iqqq")
+
+# Body of messages from before send times and sequence numbers were added
+LEGACY_MESSAGE_BODY = struct.Struct("!iq")
+
+class Message:
+    """Class to represent a message sent between machines."""
+    def __init__(self, sender_id, logical_clock, send_ns=None, seq=None):
+        self.sender_id = sender_id
+        self.logical_clock = logical_clock
+        self.send_ns = send_ns
+        self.seq = seq
+        # Set by the receiver when the message is put in its inbox
+        self.enqueue_ns = None
+
+    def to_json(self):
+        # Convert the message to a JSON string
+        return json.dumps(self.__dict__)
+
+    @staticmethod
+    def from_json(json_string):
+        # Create a message object from a JSON string
+        data = json.loads(json_string)
+        return Message(data["sender_id"], data["logical_clock"], data.get("send_ns"), data.get("seq"))
+
+    def to_bytes(self):
+        # Pack the message into a complete binary frame
+        send_ns = 0 if self.send_ns is None else self.send_ns
+        seq = -1 if self.seq is None else self.seq
+        return FRAME_HEADER.pack(MESSAGE_BODY.size, FRAME_MESSAGE) + MESSAGE_BODY.pack(self.sender_id, self.logical_clock, send_ns, seq)
+
+    @staticmethod
+    def from_body(body):
+        # Create a message object from a packed frame body
+        if len(body) == LEGACY_MESSAGE_BODY.size:
+            sender_id, logical_clock = LEGACY_MESSAGE_BODY.unpack(body)
+            return Message(sender_id, logical_clock)
+        sender_id, logical_clock, send_ns, seq = MESSAGE_BODY.unpack(body)
+        return Message(sender_id, logical_clock, send_ns or None, None if seq < 0 else seq)
+
+def encode_frame(payload: bytes, frame_type=FRAME_MESSAGE) -> bytes:
+    """Prefix a payload with the frame header so it can share a stream with other frames."""
+    return FRAME_HEADER.pack(len(payload), frame_type) + payload
+
+def credit_frame(credits: int) -> bytes:
+    """Frame granting a sender credits for that many more messages."""
+    return encode_frame(CREDIT_BODY.pack(credits), FRAME_CREDIT)
+
+class FrameDecoder:
+    """Incremental decoder that turns arbitrary stream chunks into whole frames."""
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes):
+        """Add received bytes and return the list of (frame_type, body) frames now complete."""
+        self.buffer.extend(data)
+        frames = []
+        offset = 0
+        header_size = FRAME_HEADER.size
+        buf = self.buffer
+        # Peel off every complete frame; a partial frame stays buffered for the next read
+        while len(buf) - offset >= header_size:
+            length, frame_type = FRAME_HEADER.unpack_from(buf, offset)
+            end = offset + header_size + length
+            if end > len(buf):
+                break
+            frames.append((frame_type, bytes(buf[offset + header_size:end])))
+            offset = end
+        if offset:
+            del buf[:offset]
+        return frames
+
+    def messages(self, data: bytes):
+        """Add received bytes and return the Message objects now complete."""
+        return [Message.from_body(body) for frame_type, body in self.feed(data) if frame_type == FRAME_MESSAGE]
+
+    def credits(self, data: bytes):
+        """Add received bytes and return the total credits granted by the frames now complete."""
+        return sum(CREDIT_BODY.unpack(body)[0] for frame_type, body in self.feed(data) if frame_type == FRAME_CREDIT)
+
+def recv_exact(sock, n: int):
+    """Read exactly n bytes from a socket, or return None if the peer closed the stream."""
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf.extend(chunk)
+    return bytes(buf)
+
+def read_frame(sock):
+    """Read one frame body from a socket, or return None at end of stream."""
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    length, _ = FRAME_HEADER.unpack(header)
+    return recv_exact(sock, length)